@@ -7,7 +7,9 @@ from alembic import context
 
 from app.core.config import settings
 from app.db.base_class import Base
+from app.models.blob import Blob as _
 from app.models.image import Image as _
+from app.models.retired_upload import RetiredUpload as _
 from app.models.user import User as _
 
 # this is the Alembic Config object, which provides
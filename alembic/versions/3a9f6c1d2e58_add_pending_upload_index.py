@@ -0,0 +1,37 @@
+"""Add pending upload index
+
+Revision ID: 3a9f6c1d2e58
+Revises: b5d2e8a41c07
+Create Date: 2026-10-18 11:40:02.518311
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3a9f6c1d2e58"
+down_revision: Union[str, None] = "b5d2e8a41c07"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_image_pending_upload",
+            "image",
+            ["created_at", "id"],
+            unique=False,
+            postgresql_where=sa.text("NOT uploaded"),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_image_pending_upload", table_name="image", postgresql_concurrently=True
+        )
@@ -0,0 +1,50 @@
+"""Add image feed indexes
+
+Revision ID: b5d2e8a41c07
+Revises: 9c37fc7757b4
+Create Date: 2026-10-18 09:12:44.301925
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b5d2e8a41c07"
+down_revision: Union[str, None] = "9c37fc7757b4"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Build the indexes without locking writes on an already-large image table
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_image_public_feed",
+            "image",
+            ["created_at", "id"],
+            unique=False,
+            postgresql_where=sa.text("public AND uploaded"),
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_image_owner_id_created_at",
+            "image",
+            ["owner_id", "created_at", "id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_image_owner_id_created_at",
+            table_name="image",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_image_public_feed", table_name="image", postgresql_concurrently=True
+        )
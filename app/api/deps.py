@@ -1,56 +1,108 @@
-from typing import Generator
-from boto3 import Session as AWSSession
+from time import time
+from typing import AsyncGenerator
+
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
-from sqlalchemy.orm import Session as DBSession
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.cache import LRUCache
 from app.core.config import settings
-from app.db.session import SessionLocal
+from app.db.session import AsyncSessionLocal
+from app.ext.storage import StorageBackend, get_storage as get_storage_backend
 from app.models.user import User
 from app.schemas.user import UserDetail
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login", auto_error=False)
 
+# Raw bearer token -> verified subject, so repeat requests skip the HMAC check
+token_subject_cache: LRUCache[str, str] = LRUCache(
+    settings.TOKEN_CACHE_ENTRIES, ttl=settings.TOKEN_CACHE_TTL_SECONDS
+)
+# User id -> details of an active user, so repeat requests skip the DB lookup.
+# Nothing in the API changes a user once created, so entries are never
+# invalidated: a user deactivated directly in the database keeps passing
+# auth until their entry expires, at most USER_CACHE_TTL_SECONDS.
+user_cache: LRUCache[str, UserDetail] = LRUCache(
+    settings.USER_CACHE_ENTRIES, ttl=settings.USER_CACHE_TTL_SECONDS
+)
 
-def get_db() -> Generator[DBSession, None, None]:
-    db = SessionLocal()
-    try:
+
+def decode_token_subject(token: str) -> str:
+    uid = token_subject_cache.get(token)
+    if uid is not None:
+        return uid
+
+    payload = jwt.decode(
+        token, settings.SECRET_KEY, algorithms=[settings.JWT_ALGORITHM]
+    )
+    uid = payload.get("sub")
+    if uid is None:
+        raise HTTPException(status_code=400, detail="Invalid token")
+
+    # Never remember a token past its own expiry
+    ttl = settings.TOKEN_CACHE_TTL_SECONDS
+    if payload.get("exp") is not None:
+        ttl = min(ttl, payload["exp"] - time())
+    if ttl > 0:
+        token_subject_cache.set(token, uid, ttl=ttl)
+    return uid
+
+
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    # AsyncSession only checks a connection out of the pool when it runs its
+    # first statement, so handlers that never query never hold a pool slot
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
-def get_aws_session() -> Generator[AWSSession, None, None]:
-    session = AWSSession()
-    yield session
+def get_storage() -> StorageBackend:
+    return get_storage_backend()
+
+
+async def load_active_user(uid: str, db: AsyncSession) -> UserDetail:
+    db_user = await db.scalar(select(User).where(User.id == uid))
+    if db_user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    if not db_user.is_active:
+        raise HTTPException(status_code=401, detail="Inactive user")
+
+    user = UserDetail(id=uid, username=db_user.username, email=db_user.email)
+    user_cache.set(uid, user)
+    return user
 
 
 async def get_current_user(
-    token: str = Depends(oauth2_scheme), db: DBSession = Depends(get_db)
+    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
 ) -> UserDetail:
     try:
-        payload = jwt.decode(
-            token, settings.SECRET_KEY, algorithms=[settings.JWT_ALGORITHM]
-        )
-        uid: str = payload.get("sub")
-        if uid is None:
-            raise HTTPException(status_code=400, detail="Invalid token")
-
-        db_user = db.query(User).filter(User.id == uid).first()
-        if db_user is None:
-            raise HTTPException(status_code=401, detail="User not found")
-
-        return UserDetail(id=uid, username=db_user.username, email=db_user.email)
+        uid = decode_token_subject(token)
+        user = user_cache.get(uid)
+        if user is not None:
+            return user
+
+        return await load_active_user(uid, db)
     except JWTError as exc:
         raise HTTPException(status_code=401, detail="Invalid token") from exc
 
 
 async def verify_jwt_to_uuid_or_none(
-    token: str = Depends(oauth2_scheme), db: DBSession = Depends(get_db)
+    token: str | None = Depends(optional_oauth2_scheme),
 ) -> UserDetail | None:
+    # Anonymous requests return before a session is even created; everyone
+    # else only opens one on a user cache miss, and releases it right away
+    if token is None:
+        return None
+
     try:
-        user = await get_current_user(token, db)
-        return user
-    except HTTPException:
+        uid = decode_token_subject(token)
+        user = user_cache.get(uid)
+        if user is not None:
+            return user
+
+        async with AsyncSessionLocal() as db:
+            return await load_active_user(uid, db)
+    except (HTTPException, JWTError):
         return None
@@ -0,0 +1,143 @@
+from email.utils import formatdate, parsedate_to_datetime
+import os
+from typing import Mapping, Optional, Tuple
+import uuid
+
+import anyio
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+ByteRange = Tuple[int, int]
+
+
+def make_etag(name: uuid.UUID | str, size: int) -> str:
+    # Uploads and variants are written once and renamed into place, so their
+    # name and size pin down the bytes without hashing the file
+    return f'"{name}-{size:x}"'
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    # If-None-Match uses the weak comparison function
+    if header.strip() == "*":
+        return True
+    return any(
+        candidate.strip().removeprefix("W/") == etag for candidate in header.split(",")
+    )
+
+
+def is_not_modified(
+    headers: Mapping[str, str], etag: str, stat_result: os.stat_result
+) -> bool:
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return int(stat_result.st_mtime) <= since.timestamp()
+
+    return False
+
+
+def parse_range(
+    headers: Mapping[str, str], etag: str, size: int
+) -> Optional[ByteRange]:
+    # Returns the inclusive byte range to send, or None for the whole file.
+    # Multiple ranges are rare for images and may be answered with a 200.
+    # Raises ValueError for an unsatisfiable range.
+    header = headers.get("range")
+    if header is None or not header.startswith("bytes="):
+        return None
+
+    # A stale If-Range means the client's partial copy is useless
+    if_range = headers.get("if-range")
+    if if_range is not None and if_range.strip() != etag:
+        return None
+
+    spec = header.removeprefix("bytes=").strip()
+    if "," in spec:
+        return None
+
+    first, _, last = spec.partition("-")
+    if not (first or last) or not all(
+        part == "" or part.isdigit() for part in (first, last)
+    ):
+        # Syntactically invalid ranges are ignored rather than rejected
+        return None
+
+    if not first:
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("Unsatisfiable range")
+    return start, end
+
+
+def format_http_date(timestamp: float) -> str:
+    return formatdate(timestamp, usegmt=True)
+
+
+class FileRangeResponse(FileResponse):
+    """206 Partial Content response for a single byte range of a file."""
+
+    def __init__(
+        self,
+        path: str,
+        byte_range: ByteRange,
+        stat_result: os.stat_result,
+        headers: Optional[Mapping[str, str]] = None,
+        media_type: Optional[str] = None,
+    ):
+        self.byte_range = byte_range
+        super().__init__(
+            path,
+            status_code=206,
+            headers=headers,
+            media_type=media_type,
+            stat_result=stat_result,
+        )
+
+    def set_stat_headers(self, stat_result: os.stat_result) -> None:
+        start, end = self.byte_range
+        self.headers.setdefault("content-length", str(end - start + 1))
+        self.headers.setdefault(
+            "content-range", f"bytes {start}-{end}/{stat_result.st_size}"
+        )
+        super().set_stat_headers(stat_result)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        start, end = self.byte_range
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                remaining -= len(chunk)
+                more_body = remaining > 0 and bool(chunk)
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": more_body,
+                    }
+                )
+                if not more_body:
+                    break
+        if self.background is not None:
+            await self.background()
@@ -1,6 +1,11 @@
 from fastapi import APIRouter, Response, status
+from fastapi.responses import ORJSONResponse
 
+from app.api.deps import token_subject_cache, user_cache
 from app.api.v1.endpoints import auth, images, users, feed
+from app.core.config import settings
+from app.core.security import password_hasher
+from app.ext.s3 import presigned_url_cache
 
 api_router = APIRouter()
 
@@ -10,6 +15,22 @@ async def api_health_check() -> Response:
     return Response(status_code=status.HTTP_200_OK)
 
 
+@api_router.get("/health/stats", status_code=status.HTTP_200_OK)
+async def api_health_stats() -> Response:
+    if not (settings.HEALTH_STATS_ENABLED or settings.DEBUG):
+        return ORJSONResponse(
+            {"success": False, "detail": "Not Found"}, status_code=404
+        )
+    return ORJSONResponse(
+        {
+            "presigned_urls": presigned_url_cache.stats(),
+            "password_hasher": password_hasher.stats(),
+            "tokens": token_subject_cache.stats(),
+            "users": user_cache.stats(),
+        }
+    )
+
+
 api_router.include_router(auth.router, prefix="/auth", tags=["login"])
 api_router.include_router(users.router, prefix="/users", tags=["users"])
 api_router.include_router(images.router, prefix="/images", tags=["images"])
@@ -1,13 +1,17 @@
 from datetime import timedelta
 
 from fastapi import APIRouter, Depends, Response
-from fastapi.responses import JSONResponse
-from sqlalchemy import or_
-from sqlalchemy.orm import Session
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api import deps
 from app.core.config import settings
-from app.core.security import create_access_token, get_password_hash, verify_password
+from app.core.security import (
+    PasswordHasherBusy,
+    create_access_token,
+    password_hasher,
+)
 from app.models.user import User
 from app.schemas.user import UserCreate, UserLogin
 from app.schemas.token import Token
@@ -15,18 +19,26 @@ from app.schemas.token import Token
 router = APIRouter()
 
 
+def server_busy_response() -> Response:
+    return ORJSONResponse(
+        {"success": False, "detail": "Server busy, try again shortly"},
+        status_code=503,
+        headers={"Retry-After": "1"},
+    )
+
+
 @router.post("/register/", status_code=201)
 async def auth_register(
-    user: UserCreate, db: Session = Depends(deps.get_db)
+    user: UserCreate, db: AsyncSession = Depends(deps.get_db)
 ) -> Response:
     try:
-        db_user = (
-            db.query(User)
-            .filter(or_(User.username == user.username, User.email == user.email))
-            .first()
+        db_user = await db.scalar(
+            select(User).where(
+                or_(User.username == user.username, User.email == user.email)
+            )
         )
         if db_user:
-            return JSONResponse(
+            return ORJSONResponse(
                 content={
                     "success": False,
                     "detail": "Email or username already registered",
@@ -34,18 +46,20 @@ async def auth_register(
                 status_code=400,
             )
 
-        hashed_password = get_password_hash(user.password)
+        hashed_password = await password_hasher.hash(user.password)
 
         db_user = User(
             **user.model_dump(exclude={"password"}), password_hash=hashed_password
         )
         db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        await db.commit()
+        await db.refresh(db_user)
 
         return {"success": True}
+    except PasswordHasherBusy:
+        return server_busy_response()
     except Exception as e:
-        return JSONResponse(
+        return ORJSONResponse(
             {
                 "success": False,
                 "detail": str(e) if settings.DEBUG else "Internal server error",
@@ -55,14 +69,21 @@ async def auth_register(
 
 
 @router.post("/login/", response_model=Token)
-async def auth_login(user: UserLogin, db: Session = Depends(deps.get_db)) -> Token:
+async def auth_login(user: UserLogin, db: AsyncSession = Depends(deps.get_db)) -> Token:
     try:
-        db_user = db.query(User).filter(User.username == user.username).first()
-        if not db_user or not verify_password(user.password, db_user.password_hash):
-            return JSONResponse(
+        db_user = await db.scalar(select(User).where(User.username == user.username))
+        if not db_user or not await password_hasher.verify(
+            user.password, db_user.password_hash
+        ):
+            return ORJSONResponse(
                 content={"success": False, "detail": "Invalid username or password"},
                 status_code=401,
             )
+        if not db_user.is_active:
+            return ORJSONResponse(
+                content={"success": False, "detail": "Inactive user"},
+                status_code=401,
+            )
 
         access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
@@ -70,8 +91,10 @@ async def auth_login(user: UserLogin, db: Session = Depends(deps.get_db)) -> Tok
         )
 
         return Token(access_token=access_token, token_type="bearer")
+    except PasswordHasherBusy:
+        return server_busy_response()
     except Exception as e:
-        return JSONResponse(
+        return ORJSONResponse(
             {
                 "success": False,
                 "detail": str(e) if settings.DEBUG else "Internal server error",
@@ -1,74 +1,389 @@
-from datetime import datetime, timedelta
+import asyncio
+from dataclasses import dataclass, fields
+from datetime import datetime
+import hashlib
+import heapq
+from itertools import islice
 import logging
+from operator import itemgetter
+from time import time
 import uuid
-from typing import Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
-from boto3.session import Session as AWSSession
-from fastapi import APIRouter, Depends, Response
-from fastapi.responses import JSONResponse
-from sqlalchemy import or_
-from sqlalchemy.orm import Session as DBSession
+from fastapi import APIRouter, Depends, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+import orjson
+from sqlalchemy import Select, or_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api import deps
+from app.api.responses import etag_matches
 from app.core.config import settings
-from app.ext.s3 import create_presigned_url
+from app.core.pagination import decode_cursor, encode_cursor
+from app.db.session import AsyncSessionLocal
+from app.ext.feed_cache import (
+    LATEST_FEED_SCOPE,
+    feed_position,
+    feed_surrogate_key,
+    get_feed_cache,
+    private_feed_scope,
+    user_feed_scope,
+)
+from app.ext.feed_events import feed_hub
+from app.ext.s3 import get_signing_window_start
+from app.ext.storage import StorageBackend, get_storage
 from app.models.image import Image
 from app.schemas.user import UserDetail
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 
+@dataclass(slots=True)
+class FeedImage:
+    id: uuid.UUID
+    owner_id: uuid.UUID
+    path: str
+    content_type: str
+    public: bool
+    variants: Optional[Dict[str, Any]]
+    width: Optional[int]
+    height: Optional[int]
+    orientation: Optional[int]
+    blurhash: Optional[str]
+    created_at: datetime
+
+
+# Only what the feed renders, selected as plain rows instead of hydrating
+# full Image objects into the session
+FEED_COLUMNS = [getattr(Image, field.name) for field in fields(FeedImage)]
+
+# (feed position, rendered result); pages are lists of these, newest first
+FeedEntry = Tuple[str, Dict[str, Any]]
+
+
+async def paginate_images(
+    db: AsyncSession,
+    query: Select,
+    keyset: Optional[Tuple[datetime, uuid.UUID]],
+    before: Optional[datetime],
+    after: Optional[datetime],
+) -> List[FeedImage]:
+    if keyset is not None:
+        query = query.where(tuple_(Image.created_at, Image.id) < keyset)
+    if before is not None:
+        query = query.where(Image.created_at < before)
+    if after is not None:
+        query = query.where(Image.created_at > after)
+
+    # Fetch one extra row to know whether another page exists without a COUNT
+    rows = await db.execute(
+        query.order_by(Image.created_at.desc(), Image.id.desc()).limit(
+            settings.IMAGE_PAGINATION + 1
+        )
+    )
+    return [FeedImage(*row) for row in rows]
+
+
+def render_feed_images(
+    images: List[FeedImage], storage: StorageBackend
+) -> List[FeedEntry]:
+    entries = []
+    for image in images:
+        image_id = str(image.id)
+        result = {
+            # asyncpg returns its own UUID type, which orjson can't encode
+            "id": image_id,
+            "creator": str(image.owner_id),
+            "download_url": storage.download_url(
+                image_id, image.path, image.content_type, image.public
+            ),
+            "variants": {
+                name: storage.download_url(
+                    image_id, variant["path"], variant["content_type"], image.public
+                )
+                for name, variant in (image.variants or {}).items()
+            },
+            "width": image.width,
+            "height": image.height,
+            "orientation": image.orientation,
+            "blurhash": image.blurhash,
+            # Kept in str(datetime) form rather than orjson's ISO 8601 "T"
+            # form, which clients already parse
+            "created_at": str(image.created_at),
+        }
+        entries.append((feed_position(image.created_at, image.id), result))
+    return entries
+
+
+def build_feed_content(entries: List[FeedEntry]) -> Dict[str, Any]:
+    page = entries[: settings.IMAGE_PAGINATION]
+    next_cursor = None
+    if len(entries) > settings.IMAGE_PAGINATION:
+        last = page[-1][1]
+        next_cursor = encode_cursor(
+            datetime.fromisoformat(last["created_at"]), uuid.UUID(last["id"])
+        )
+
+    return {
+        "success": True,
+        "next_cursor": next_cursor,
+        "results": [result for _, result in page],
+    }
+
+
+def feed_etag(data: bytes) -> str:
+    return f'"{hashlib.blake2b(data, digest_size=16).hexdigest()}"'
+
+
+async def versioned_feed_etag(
+    scopes: List[str], keyset: Optional[Tuple[datetime, uuid.UUID]]
+) -> Optional[str]:
+    """Returns the ETag of a feed page without reading or rendering it.
+
+    Any change to an image a page could show bumps one of `scopes`' versions,
+    so they, the signing window of its URLs and its cursor identify the page.
+    Read before the page itself, so a change that lands in between can only
+    pair an older ETag with newer content, never the reverse. None when
+    there is no feed cache to keep versions.
+    """
+    feed_cache = get_feed_cache()
+    if feed_cache is None:
+        return None
+    try:
+        validators = [await feed_cache.validator(scope) for scope in scopes]
+    except Exception:
+        logger.exception("Could not read feed versions %s", " ".join(scopes))
+        return None
+    upper = feed_position(*keyset) if keyset is not None else ""
+    window = int(get_signing_window_start().timestamp())
+    return feed_etag(" ".join([str(window), upper, *scopes, *validators]).encode())
+
+
+async def public_feed_entries(
+    db: AsyncSession,
+    storage: StorageBackend,
+    scope: str,
+    query: Select,
+    keyset: Optional[Tuple[datetime, uuid.UUID]],
+) -> List[FeedEntry]:
+    feed_cache = get_feed_cache()
+    if feed_cache is None:
+        images = await paginate_images(db, query, keyset, None, None)
+        return render_feed_images(images, storage)
+
+    # Signed URLs change with the signing window, so pages are per window
+    upper = feed_position(*keyset) if keyset is not None else None
+    key = f"{int(get_signing_window_start().timestamp())}:{upper or ''}"
+    version = None
+    try:
+        cached = await feed_cache.get(scope, key)
+        if cached is not None:
+            return orjson.loads(cached)
+        version = await feed_cache.version(scope)
+    except Exception:
+        logger.exception("Could not read feed page %s %s", scope, key)
+
+    images = await paginate_images(db, query, keyset, None, None)
+    entries = render_feed_images(images, storage)
+    if version is not None:
+        # A full page only covers positions down to its extra row; a short one
+        # is the end of the feed and covers everything below the cursor
+        lower = entries[-1][0] if len(entries) > settings.IMAGE_PAGINATION else None
+        try:
+            await feed_cache.put(
+                scope, key, version, lower, upper, orjson.dumps(entries)
+            )
+        except Exception:
+            logger.exception("Could not store feed page %s %s", scope, key)
+    return entries
+
+
+def merge_feed_entries(*pages: List[FeedEntry]) -> List[FeedEntry]:
+    # Each page holds the newest IMAGE_PAGINATION + 1 entries of its own kind
+    # below the cursor, so their newest IMAGE_PAGINATION + 1 overall are exact
+    merged = heapq.merge(*pages, key=itemgetter(0), reverse=True)
+    return list(islice(merged, settings.IMAGE_PAGINATION + 1))
+
+
+def feed_headers(user: UserDetail | None, scope: str) -> Dict[str, str]:
+    if user is None:
+        # Anonymous pages are the same for everyone, so edge caches keep them
+        # until the signed URLs inside expire or an upload purges the scope
+        window_end = (
+            int(get_signing_window_start().timestamp())
+            + settings.CLOUDFRONT_PRESIGNED_URL_EXPIRY
+        )
+        headers = {
+            "cache-control": "public, max-age=0, "
+            f"s-maxage={max(window_end - int(time()), 0)}",
+            "surrogate-key": feed_surrogate_key(scope),
+        }
+    else:
+        headers = {"cache-control": "private, no-cache"}
+    return headers | {"vary": "Authorization"}
+
+
+def not_modified_response(
+    request: Request, etag: str, headers: Dict[str, str]
+) -> Optional[Response]:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers | {"etag": etag})
+    return None
+
+
+def feed_response(
+    request: Request,
+    entries: List[FeedEntry],
+    etag: Optional[str],
+    headers: Dict[str, str],
+) -> Response:
+    data = orjson.dumps(build_feed_content(entries))
+    if etag is None:
+        # Pages without versions are validated by their content instead,
+        # which takes rendering them first
+        etag = feed_etag(data)
+        not_modified = not_modified_response(request, etag, headers)
+        if not_modified is not None:
+            return not_modified
+    return Response(
+        data, media_type="application/json", headers=headers | {"etag": etag}
+    )
+
+
+async def publish_confirmed_image(image_id: str, owner_id: str, public: bool) -> None:
+    # Renders a newly confirmed image once for every stream subscriber here
+    try:
+        async with AsyncSessionLocal() as db:
+            row = (
+                await db.execute(
+                    select(*FEED_COLUMNS).where(Image.id == image_id, Image.uploaded)
+                )
+            ).first()
+        if row is None:
+            return
+        [(_, result)] = render_feed_images([FeedImage(*row)], get_storage())
+        feed_hub.publish(owner_id, public, orjson.dumps(result))
+    except Exception:
+        logger.exception("Could not publish image %s to feed streams", image_id)
+
+
+def stream_feed(user: UserDetail | None, creator: Optional[uuid.UUID]) -> Response:
+    if not settings.FEED_STREAM_ENABLED:
+        return ORJSONResponse(
+            {"success": False, "detail": "Feed streaming is disabled"},
+            status_code=503,
+        )
+
+    async def events() -> AsyncIterator[bytes]:
+        # Subscribed only once streaming starts, so the finally always runs
+        subscriber = feed_hub.subscribe(
+            str(user.id) if user is not None else None,
+            str(creator) if creator is not None else None,
+        )
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.FEED_STREAM_MAX_SECONDS
+        try:
+            while (remaining := deadline - loop.time()) > 0:
+                try:
+                    data = await asyncio.wait_for(
+                        subscriber.queue.get(),
+                        min(remaining, settings.FEED_STREAM_HEARTBEAT_SECONDS),
+                    )
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle connection
+                    yield b": keepalive\n\n"
+                    continue
+                if data is None:
+                    return
+                yield b"event: image\ndata: " + data + b"\n\n"
+        finally:
+            feed_hub.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"cache-control": "no-cache", "x-accel-buffering": "no"},
+    )
+
+
+def invalid_cursor_response() -> Response:
+    return ORJSONResponse(
+        {"success": False, "detail": "Invalid pagination cursor"}, status_code=400
+    )
+
+
 @router.get("/latest")
 async def feed_latest(
-    before: datetime = datetime.now() + timedelta(days=1),  # buffer for timezones
-    after: datetime = datetime.fromtimestamp(0),
+    request: Request,
+    cursor: Optional[str] = None,
+    before: Optional[datetime] = None,
+    after: Optional[datetime] = None,
     user: UserDetail | None = Depends(deps.verify_jwt_to_uuid_or_none),
-    db: DBSession = Depends(deps.get_db),
-    aws: Optional[AWSSession] = Depends(deps.get_aws_session),
+    db: AsyncSession = Depends(deps.get_db),
+    storage: StorageBackend = Depends(deps.get_storage),
 ) -> Response:
     try:
-        image_filters = [
-            Image.created_at < before,
-            Image.created_at > after,
-            Image.public,
-        ]
-
-        if user is not None:
-            image_filters[-1] = or_(Image.public, Image.owner_id == user.id)
-
-        db_images = (
-            db.query(Image)
-            .filter(*image_filters)
-            .order_by(Image.created_at.desc())
-            .limit(settings.IMAGE_PAGINATION)
-        )
+        keyset = decode_cursor(cursor) if cursor is not None else None
+    except ValueError:
+        return invalid_cursor_response()
 
-        return_content = {"success": True, "count": db_images.count(), "results": []}
-        for image_record in db_images:
-            if settings.PRODUCTION:
-                download_part_url = create_presigned_url(
-                    aws,
-                    image_record.path,
-                    image_record.content_type,
-                    image_record.public,
-                )
-            else:
-                download_part_url = (
-                    f"{settings.API_V1_STR}/images/media/dev/{image_record.id}"
+    try:
+        headers = feed_headers(user, LATEST_FEED_SCOPE)
+        etag = None
+        if before is None and after is None:
+            scopes = [LATEST_FEED_SCOPE]
+            if user is not None:
+                scopes.append(private_feed_scope(user.id))
+            # Answered before the page is read, rendered and encoded
+            etag = await versioned_feed_etag(scopes, keyset)
+            if etag is not None:
+                not_modified = not_modified_response(request, etag, headers)
+                if not_modified is not None:
+                    return not_modified
+
+            # Everyone shares the cached public page; a signed-in viewer's own
+            # private images are merged into it
+            entries = await public_feed_entries(
+                db,
+                storage,
+                LATEST_FEED_SCOPE,
+                select(*FEED_COLUMNS).where(Image.uploaded, Image.public),
+                keyset,
+            )
+            if user is not None:
+                private_images = await paginate_images(
+                    db,
+                    select(*FEED_COLUMNS).where(
+                        Image.owner_id == user.id,
+                        Image.uploaded,
+                        Image.public.is_(False),
+                    ),
+                    keyset,
+                    None,
+                    None,
                 )
+                private_entries = render_feed_images(private_images, storage)
+                entries = merge_feed_entries(entries, private_entries)
+        else:
+            visibility = Image.public
+            if user is not None:
+                visibility = or_(Image.public, Image.owner_id == user.id)
 
-            return_content["results"].append(
-                {
-                    "id": str(image_record.id),
-                    "creator": str(image_record.owner_id),
-                    "download_url": download_part_url,
-                    "created_at": str(image_record.created_at),
-                }
+            db_images = await paginate_images(
+                db,
+                select(*FEED_COLUMNS).where(Image.uploaded, visibility),
+                keyset,
+                before,
+                after,
             )
+            entries = render_feed_images(db_images, storage)
 
-        return JSONResponse(return_content)
+        return feed_response(request, entries, etag, headers)
     except Exception as e:
-        return JSONResponse(
+        return ORJSONResponse(
             {
                 "success": False,
                 "detail": str(e) if settings.DEBUG else "Internal server error",
@@ -80,56 +395,93 @@ async def feed_latest(
 @router.get("/by_user/{creator}")
 async def feed_by_user(
     creator: uuid.UUID,
-    before: datetime = datetime.now() + timedelta(days=1),  # buffer for timezones
-    after: datetime = datetime.fromtimestamp(0),
+    request: Request,
+    cursor: Optional[str] = None,
+    before: Optional[datetime] = None,
+    after: Optional[datetime] = None,
     user: UserDetail | None = Depends(deps.verify_jwt_to_uuid_or_none),
-    db: DBSession = Depends(deps.get_db),
-    aws: Optional[AWSSession] = Depends(deps.get_aws_session),
+    db: AsyncSession = Depends(deps.get_db),
+    storage: StorageBackend = Depends(deps.get_storage),
 ) -> Response:
+    try:
+        keyset = decode_cursor(cursor) if cursor is not None else None
+    except ValueError:
+        return invalid_cursor_response()
+
     try:
         user_id = user.id if user is not None else None
+        owner = user_id is not None and str(user_id) == str(creator)
 
-        db_images = (
-            db.query(Image)
-            .filter(
-                Image.created_at < before,
-                Image.created_at > after,
-                Image.owner_id == creator,
-                or_(Image.owner_id == user_id, Image.public),
-            )
-            .order_by(Image.created_at.desc())
-            .limit(settings.IMAGE_PAGINATION)
-        )
+        headers = feed_headers(user, user_feed_scope(creator))
+        etag = None
+        if before is None and after is None:
+            scopes = [user_feed_scope(creator)]
+            if owner:
+                scopes.append(private_feed_scope(creator))
+            etag = await versioned_feed_etag(scopes, keyset)
+            if etag is not None:
+                not_modified = not_modified_response(request, etag, headers)
+                if not_modified is not None:
+                    return not_modified
 
-        return_content = {"success": True, "count": db_images.count(), "results": []}
-        for image_record in db_images:
-            if settings.PRODUCTION:
-                download_part_url = create_presigned_url(
-                    aws,
-                    image_record.path,
-                    image_record.content_type,
-                    image_record.public,
-                )
-            else:
-                download_part_url = (
-                    f"{settings.API_V1_STR}/images/media/dev/{image_record.id}"
+            entries = await public_feed_entries(
+                db,
+                storage,
+                user_feed_scope(creator),
+                select(*FEED_COLUMNS).where(
+                    Image.owner_id == creator, Image.uploaded, Image.public
+                ),
+                keyset,
+            )
+            if owner:
+                private_images = await paginate_images(
+                    db,
+                    select(*FEED_COLUMNS).where(
+                        Image.owner_id == creator,
+                        Image.uploaded,
+                        Image.public.is_(False),
+                    ),
+                    keyset,
+                    None,
+                    None,
                 )
-
-            return_content["results"].append(
-                {
-                    "id": str(image_record.id),
-                    "creator": str(image_record.owner_id),
-                    "download_url": download_part_url,
-                    "created_at": str(image_record.created_at),
-                }
+                private_entries = render_feed_images(private_images, storage)
+                entries = merge_feed_entries(entries, private_entries)
+        else:
+            db_images = await paginate_images(
+                db,
+                select(*FEED_COLUMNS).where(
+                    Image.owner_id == creator,
+                    Image.uploaded,
+                    or_(Image.owner_id == user_id, Image.public),
+                ),
+                keyset,
+                before,
+                after,
             )
+            entries = render_feed_images(db_images, storage)
 
-        return JSONResponse(return_content)
+        return feed_response(request, entries, etag, headers)
     except Exception as e:
-        return JSONResponse(
+        return ORJSONResponse(
             {
                 "success": False,
                 "detail": str(e) if settings.DEBUG else "Internal server error",
             },
             status_code=500,
         )
+
+
+@router.get("/stream")
+async def feed_stream(
+    user: UserDetail | None = Depends(deps.verify_jwt_to_uuid_or_none),
+) -> Response:
+    return stream_feed(user, None)
+
+
+@router.get("/by_user/{creator}/stream")
+async def feed_by_user_stream(
+    creator: uuid.UUID,
+    user: UserDetail | None = Depends(deps.verify_jwt_to_uuid_or_none),
+) -> Response:
+    return stream_feed(user, creator)
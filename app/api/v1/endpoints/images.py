@@ -1,39 +1,92 @@
+import asyncio
 import os
+from time import time
+from typing import List
 import uuid
-from typing import Optional
 
-import aiofiles
-from boto3.session import Session as AWSSession
-from fastapi import APIRouter, UploadFile, Depends, Response
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    UploadFile,
+    Depends,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, ORJSONResponse
 from magic import from_buffer
 from pydantic import UUID4
-from sqlalchemy.orm import Session as DBSession
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api import deps
-from app.ext.s3 import create_presigned_post, create_presigned_url, verify_exists
+from app.api.responses import (
+    FileRangeResponse,
+    format_http_date,
+    is_not_modified,
+    make_etag,
+    parse_range,
+)
+from app.blobs import (
+    abandon_blob_claim,
+    claim_blob,
+    finish_blob_claim,
+    lock_image,
+    release_image,
+)
+from app.ext.feed_cache import purge_feed_keys
+from app.ext.feed_events import notify_image_confirmed
+from app.ext.local import UploadTooLarge
+from app.image_access import ImageAccess, load_image_access, load_image_accesses
+from app.invalidation import invalidate_images
+from app.ext.storage import FilesystemStorage, StorageBackend
 from app.core.config import settings
+from app.core.security import verify_media_url
 from app.models.image import Image
+from app.schemas.image import ImageIds
 from app.schemas.user import UserDetail
+from app.variants import process_upload
 
 router = APIRouter()
 
 
+def invalid_privacy_response() -> Response:
+    return ORJSONResponse(
+        content={
+            "success": False,
+            "detail": "privacy parameter should be 'public' or 'private'",
+        },
+        status_code=400,
+    )
+
+
+def can_view(access: ImageAccess | None, user: UserDetail | None) -> bool:
+    # Public images are visible to anyone, private ones only to their owner
+    return access is not None and (
+        access.public or (user is not None and access.owner_id == user.id)
+    )
+
+
+def local_storage_disabled_response() -> Response:
+    return ORJSONResponse(
+        {
+            "success": False,
+            "detail": "Attempted to access local storage path with remote storage",
+        },
+        status_code=400,
+    )
+
+
 @router.post("/upload/{privacy}/generate")
 async def images_generate_upload_link(
     privacy: str,
     user: UserDetail = Depends(deps.get_current_user),
-    db: DBSession = Depends(deps.get_db),
-    aws: Optional[AWSSession] = Depends(deps.get_aws_session),
+    db: AsyncSession = Depends(deps.get_db),
+    storage: StorageBackend = Depends(deps.get_storage),
 ) -> Response:
     if privacy not in ["public", "private"]:
-        return JSONResponse(
-            content={
-                "success": False,
-                "detail": "privacy parameter should be 'public' or 'private'",
-            },
-            status_code=400,
-        )
+        return invalid_privacy_response()
 
     public = privacy == "public"
     image_id = str(uuid.uuid4())
@@ -43,56 +96,198 @@ async def images_generate_upload_link(
         owner_id=user.id,
         content_type="image/jpeg",
     )
-
-    if settings.PRODUCTION:
-        presigned_post = create_presigned_post(aws, image_id, public)
-        db_image.path = presigned_post["s3_uri"]
-        create_response = presigned_post["create_response"] | {"id": image_id}
-    else:
-        db_image.path = os.path.join(settings.LOCAL_UPLOAD_DIR, f"{image_id}.jpg")
-        create_response = {
-            "url": f"{settings.API_V1_STR}/images/upload/dev/{image_id}",
-            "id": image_id,
-        }
+    db_image.path, create_response = storage.create_upload(image_id, public)
 
     db.add(db_image)
-    db.commit()
-    db.refresh(db_image)
+    await db.commit()
+    await db.refresh(db_image)
 
-    return JSONResponse({"success": True} | create_response)
+    return ORJSONResponse({"success": True} | create_response)
+
+
+@router.post("/upload/{privacy}/generate/batch")
+async def images_generate_upload_links(
+    privacy: str,
+    count: int,
+    user: UserDetail = Depends(deps.get_current_user),
+    db: AsyncSession = Depends(deps.get_db),
+    storage: StorageBackend = Depends(deps.get_storage),
+) -> Response:
+    if privacy not in ["public", "private"]:
+        return invalid_privacy_response()
+
+    if not 1 <= count <= settings.UPLOAD_BATCH_MAX_COUNT:
+        return ORJSONResponse(
+            content={
+                "success": False,
+                "detail": "count should be between 1 and "
+                f"{settings.UPLOAD_BATCH_MAX_COUNT}",
+            },
+            status_code=400,
+        )
+
+    public = privacy == "public"
+    rows, uploads = [], []
+    for _ in range(count):
+        image_id = str(uuid.uuid4())
+        path, create_response = storage.create_upload(image_id, public)
+        rows.append(
+            {
+                "id": image_id,
+                "path": path,
+                "public": public,
+                "owner_id": user.id,
+                "content_type": "image/jpeg",
+            }
+        )
+        uploads.append(create_response)
+
+    # A single executemany INSERT instead of one round-trip per image
+    await db.execute(insert(Image), rows)
+    await db.commit()
+
+    return ORJSONResponse({"success": True, "uploads": uploads})
+
+
+async def upload_exists(storage: StorageBackend, path: str) -> bool:
+    # Both backends block (boto3 or disk), so checks run on the threadpool
+    return await asyncio.to_thread(storage.exists, path)
 
 
 @router.post("/upload/{image_id}/confirm")
 async def images_confirm_uploaded(
     image_id: UUID4,
+    background_tasks: BackgroundTasks,
     user: UserDetail = Depends(deps.get_current_user),
-    db: DBSession = Depends(deps.get_db),
-    aws: AWSSession = Depends(deps.get_aws_session),
+    db: AsyncSession = Depends(deps.get_db),
+    storage: StorageBackend = Depends(deps.get_storage),
 ) -> Response:
-    db_image = db.query(Image).filter(Image.id == image_id).first()
+    db_image = await db.scalar(select(Image).where(Image.id == image_id))
     if (not db_image) or ((not db_image.public) and (db_image.owner_id != user.id)):
-        return JSONResponse(
+        return ORJSONResponse(
             {"success": False, "detail": "Image not found"}, status_code=404
         )
 
     if db_image.uploaded:
-        return JSONResponse(
+        return ORJSONResponse(
             {"success": False, "detail": "Image upload already confirmed"},
             status_code=404,
         )
 
-    if not verify_exists(aws, db_image.path):
-        return JSONResponse(
+    if not await upload_exists(storage, db_image.path):
+        return ORJSONResponse(
             {"success": False, "detail": "Image with that ID doesn't exist in S3"},
             status_code=404,
         )
 
     db_image.uploaded = True
     db.add(db_image)
-    db.commit()
-    db.refresh(db_image)
+    await db.commit()
+    await db.refresh(db_image)
 
-    return JSONResponse({"success": True})
+    keys = await invalidate_images([db_image])
+    if keys:
+        background_tasks.add_task(purge_feed_keys, keys)
+    background_tasks.add_task(
+        process_upload, storage, db_image.id, db_image.path, notify=True
+    )
+    return ORJSONResponse({"success": True})
+
+
+@router.post("/upload/confirm/batch")
+async def images_confirm_uploaded_batch(
+    body: ImageIds,
+    background_tasks: BackgroundTasks,
+    user: UserDetail = Depends(deps.get_current_user),
+    db: AsyncSession = Depends(deps.get_db),
+    storage: StorageBackend = Depends(deps.get_storage),
+) -> Response:
+    image_ids = list(dict.fromkeys(body.ids))
+    if not 1 <= len(image_ids) <= settings.UPLOAD_BATCH_MAX_COUNT:
+        return ORJSONResponse(
+            content={
+                "success": False,
+                "detail": "ids should contain between 1 and "
+                f"{settings.UPLOAD_BATCH_MAX_COUNT} images",
+            },
+            status_code=400,
+        )
+
+    db_images = {
+        db_image.id: db_image
+        for db_image in await db.scalars(select(Image).where(Image.id.in_(image_ids)))
+    }
+
+    results = {}
+    pending = []
+    for image_id in image_ids:
+        db_image = db_images.get(image_id)
+        if (not db_image) or ((not db_image.public) and (db_image.owner_id != user.id)):
+            results[image_id] = {"success": False, "detail": "Image not found"}
+        elif db_image.uploaded:
+            results[image_id] = {
+                "success": False,
+                "detail": "Image upload already confirmed",
+            }
+        else:
+            pending.append(db_image)
+
+    # Check every outstanding upload at once, bounded so one album can't
+    # monopolize the S3 connection pool
+    semaphore = asyncio.Semaphore(settings.UPLOAD_CONFIRM_CONCURRENCY)
+
+    async def check(db_image: Image) -> bool:
+        async with semaphore:
+            return await upload_exists(storage, db_image.path)
+
+    found = await asyncio.gather(
+        *(check(db_image) for db_image in pending), return_exceptions=True
+    )
+
+    confirmed = []
+    for db_image, exists in zip(pending, found):
+        if isinstance(exists, Exception):
+            results[db_image.id] = {
+                "success": False,
+                "detail": str(exists) if settings.DEBUG else "Internal server error",
+            }
+        elif not exists:
+            results[db_image.id] = {
+                "success": False,
+                "detail": "Image with that ID doesn't exist in S3",
+            }
+        else:
+            confirmed.append(db_image)
+            results[db_image.id] = {"success": True}
+
+    if confirmed:
+        await db.execute(
+            update(Image)
+            .where(
+                Image.id.in_([db_image.id for db_image in confirmed]),
+                Image.uploaded.is_(False),
+            )
+            .values(uploaded=True)
+        )
+        await db.commit()
+
+    # Images of one owner share their surrogate keys, so purge each just once
+    keys = await invalidate_images(confirmed)
+    if keys:
+        background_tasks.add_task(purge_feed_keys, keys)
+    for db_image in confirmed:
+        background_tasks.add_task(
+            process_upload, storage, db_image.id, db_image.path, notify=True
+        )
+
+    return ORJSONResponse(
+        {
+            "success": True,
+            "results": [
+                {"id": str(image_id)} | results[image_id] for image_id in image_ids
+            ],
+        }
+    )
 
 
 # Image upload route
@@ -100,26 +295,22 @@ async def images_confirm_uploaded(
 async def images_upload_local(
     file: UploadFile,
     image_id: UUID4,
+    background_tasks: BackgroundTasks,
     user: UserDetail = Depends(deps.get_current_user),
-    db: DBSession = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_db),
+    storage: StorageBackend = Depends(deps.get_storage),
 ) -> Response:
-    if settings.PRODUCTION:
-        return JSONResponse(
-            {
-                "success": False,
-                "detail": "Attempted to access development path in production",
-            },
-            status_code=400,
-        )
+    if not isinstance(storage, FilesystemStorage):
+        return local_storage_disabled_response()
 
-    db_image = db.query(Image).filter(Image.id == image_id).first()
+    db_image = await db.scalar(select(Image).where(Image.id == image_id))
     if (not db_image) or (db_image.owner_id != user.id):
-        return JSONResponse(
+        return ORJSONResponse(
             {"success": False, "detail": "Path not found"}, status_code=404
         )
 
     if db_image.uploaded:
-        return JSONResponse(
+        return ORJSONResponse(
             {"success": False, "detail": "Image already uploaded"}, status_code=400
         )
 
@@ -128,7 +319,7 @@ async def images_upload_local(
         # Generate a unique filename
         uploaded_content_type = from_buffer(first_chunk, mime=True)
         if uploaded_content_type not in ["image/jpeg"]:
-            return JSONResponse(
+            return ORJSONResponse(
                 content={
                     "success": False,
                     "detail": "Image should be jpeg",
@@ -137,18 +328,51 @@ async def images_upload_local(
             )
 
         # Save the uploaded file
-        async with aiofiles.open(db_image.path, "wb") as image_file:
-            await image_file.write(first_chunk)
-            while chunk := await file.read(settings.CHUNK_SIZE):
-                await image_file.write(chunk)
+        stored, header = await run_in_threadpool(
+            storage.save, file.file, db_image.path, first_chunk
+        )
 
-        db_image.uploaded = True
-        db.commit()
-        db.refresh(db_image)
+        # A duplicate of an existing blob drops its copy and reuses the blob's
+        # derivatives, so only new content needs processing
+        upload_path = db_image.path
+        claim = await claim_blob(db, storage, db_image, stored.sha256, stored.size)
+        if claim is None:
+            # Deleted while it was being saved
+            await asyncio.to_thread(storage.delete, upload_path)
+            return ORJSONResponse(
+                {"success": False, "detail": "Path not found"}, status_code=404
+            )
+        blob, created = claim.blob, claim.created
+        try:
+            if created and header is not None:
+                db_image.width = blob.width = header.width
+                db_image.height = blob.height = header.height
+                db_image.orientation = blob.orientation = header.orientation
+            db_image.uploaded = True
+            await notify_image_confirmed(
+                db, db_image.id, db_image.owner_id, db_image.public
+            )
+            await db.commit()
+        except BaseException:
+            await abandon_blob_claim(storage, claim)
+            raise
+        await finish_blob_claim(storage, claim)
+        await db.refresh(db_image)
 
-        return JSONResponse({"success": True})
+        keys = await invalidate_images([db_image])
+        if keys:
+            background_tasks.add_task(purge_feed_keys, keys)
+        if created:
+            background_tasks.add_task(
+                process_upload, storage, db_image.id, db_image.path
+            )
+        return ORJSONResponse({"success": True})
+    except UploadTooLarge:
+        return ORJSONResponse(
+            {"success": False, "detail": "Image is too large"}, status_code=413
+        )
     except Exception as e:
-        return JSONResponse(
+        return ORJSONResponse(
             {
                 "success": False,
                 "detail": str(e) if settings.DEBUG else "Internal server error",
@@ -162,36 +386,27 @@ async def images_upload_local(
 async def images_retrieve(
     image_id: UUID4,
     user: UserDetail | None = Depends(deps.verify_jwt_to_uuid_or_none),
-    db: DBSession = Depends(deps.get_db),
-    aws: Optional[AWSSession] = Depends(deps.get_aws_session),
+    db: AsyncSession = Depends(deps.get_db),
+    storage: StorageBackend = Depends(deps.get_storage),
 ) -> Response:
     try:
-        user_id = user.id if user is not None else ""
-        db_image = db.query(Image).filter(Image.id == image_id).first()
-        if (not db_image) or ((not db_image.public) and (db_image.owner_id != user_id)):
-            return JSONResponse(
+        access = await load_image_access(db, image_id)
+        if not can_view(access, user):
+            return ORJSONResponse(
                 {"success": False, "detail": "Image not found"}, status_code=404
             )
 
-        if settings.PRODUCTION:
-            return JSONResponse(
-                {
-                    "success": True,
-                    "uri": create_presigned_url(
-                        aws, db_image.path, db_image.content_type, db_image.public
-                    ),
-                }
-            )
-        else:
-            return JSONResponse(
-                {
-                    "success": True,
-                    "uri": f"{settings.API_V1_STR}/images/media/dev/{image_id}",
-                }
-            )
+        return ORJSONResponse(
+            {
+                "success": True,
+                "uri": storage.download_url(
+                    str(image_id), access.path, access.content_type, access.public
+                ),
+            }
+        )
 
     except Exception as e:
-        return JSONResponse(
+        return ORJSONResponse(
             {
                 "success": False,
                 "detail": str(e) if settings.DEBUG else "Internal server error",
@@ -200,37 +415,215 @@ async def images_retrieve(
         )
 
 
-# Image retrieval route
-@router.get("/media/dev/{image_id}")
-async def images_retrieve_local(
-    image_id: UUID4,
+@router.get("/media")
+async def images_retrieve_batch(
+    ids: List[UUID4] = Query([]),
     user: UserDetail | None = Depends(deps.verify_jwt_to_uuid_or_none),
-    db: DBSession = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_db),
+    storage: StorageBackend = Depends(deps.get_storage),
 ) -> Response:
-    if settings.PRODUCTION:
-        return JSONResponse(
-            {
+    image_ids = list(dict.fromkeys(ids))
+    if not 1 <= len(image_ids) <= settings.MEDIA_BATCH_MAX_COUNT:
+        return ORJSONResponse(
+            content={
                 "success": False,
-                "detail": "Attempted to access development path in production",
+                "detail": "ids should contain between 1 and "
+                f"{settings.MEDIA_BATCH_MAX_COUNT} images",
             },
             status_code=400,
         )
 
     try:
+        accesses = await load_image_accesses(db, image_ids)
+        results = []
+        for image_id in image_ids:
+            access = accesses[image_id]
+            if can_view(access, user):
+                results.append(
+                    {
+                        "id": str(image_id),
+                        "success": True,
+                        "uri": storage.download_url(
+                            str(image_id),
+                            access.path,
+                            access.content_type,
+                            access.public,
+                        ),
+                    }
+                )
+            else:
+                results.append(
+                    {"id": str(image_id), "success": False, "detail": "Image not found"}
+                )
+
+        return ORJSONResponse({"success": True, "results": results})
+
+    except Exception as e:
+        return ORJSONResponse(
+            {
+                "success": False,
+                "detail": str(e) if settings.DEBUG else "Internal server error",
+            },
+            status_code=500,
+        )
+
+
+@router.delete("/{image_id}")
+async def images_delete(
+    image_id: UUID4,
+    background_tasks: BackgroundTasks,
+    user: UserDetail = Depends(deps.get_current_user),
+    db: AsyncSession = Depends(deps.get_db),
+    storage: StorageBackend = Depends(deps.get_storage),
+) -> Response:
+    try:
+        # Locked so a deletion can't interleave with claim_blob
+        db_image = await lock_image(db, image_id)
+        if (not db_image) or (db_image.owner_id != user.id):
+            return ORJSONResponse(
+                {"success": False, "detail": "Image not found"}, status_code=404
+            )
+
+        paths = await release_image(db, db_image)
+        await db.commit()
+
+        keys = await invalidate_images([db_image])
+        if keys:
+            background_tasks.add_task(purge_feed_keys, keys)
+
+        # Only removed once nothing references them any more
+        for path in paths:
+            await asyncio.to_thread(storage.delete, path)
+        return ORJSONResponse({"success": True})
+    except Exception as e:
+        return ORJSONResponse(
+            {
+                "success": False,
+                "detail": str(e) if settings.DEBUG else "Internal server error",
+            },
+            status_code=500,
+        )
+
+
+async def serve_local_image(
+    request: Request,
+    path: str,
+    media_type: str | None,
+    cache_control: str,
+) -> Response:
+    try:
+        stat_result = await asyncio.to_thread(os.stat, path)
+    except FileNotFoundError:
+        return ORJSONResponse(
+            {"success": False, "detail": "Image not found"}, status_code=404
+        )
+
+    # Stored files are never rewritten in place, so their name identifies them
+    etag = make_etag(os.path.basename(path), stat_result.st_size)
+    headers = {
+        "etag": etag,
+        "last-modified": format_http_date(stat_result.st_mtime),
+        "accept-ranges": "bytes",
+        "cache-control": cache_control,
+    }
+
+    # Answer revalidations without ever opening the file
+    if is_not_modified(request.headers, etag, stat_result):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        byte_range = parse_range(request.headers, etag, stat_result.st_size)
+    except ValueError:
+        return Response(
+            status_code=416,
+            headers={"content-range": f"bytes */{stat_result.st_size}"},
+        )
+
+    if byte_range is not None:
+        return FileRangeResponse(
+            path, byte_range, stat_result, headers=headers, media_type=media_type
+        )
+
+    return FileResponse(
+        path, headers=headers, media_type=media_type, stat_result=stat_result
+    )
+
+
+# Image retrieval route
+@router.get("/media/dev/{image_id}")
+async def images_retrieve_local(
+    image_id: UUID4,
+    request: Request,
+    expires: int | None = None,
+    public: bool = False,
+    variant: str = Query("jpg", pattern=r"^(\d+\.)?(jpg|webp)$"),
+    file: str | None = None,
+    signature: str | None = None,
+    db: AsyncSession = Depends(deps.get_db),
+    storage: StorageBackend = Depends(deps.get_storage),
+) -> Response:
+    if not isinstance(storage, FilesystemStorage):
+        return local_storage_disabled_response()
+
+    try:
+        if signature is not None:
+            # Signed URLs authorize themselves: no token decode and no queries
+            path = storage.resolve(file) if file is not None else None
+            if (
+                path is None
+                or expires is None
+                or not verify_media_url(str(image_id), expires, public, file, signature)
+            ):
+                return ORJSONResponse(
+                    {"success": False, "detail": "Invalid or expired signature"},
+                    status_code=403,
+                )
+
+            return await serve_local_image(
+                request,
+                path,
+                None,
+                (
+                    f"public, max-age={settings.MEDIA_CACHE_MAX_AGE}, immutable"
+                    if public
+                    else f"private, max-age={max(expires - int(time()), 0)}, immutable"
+                ),
+            )
+
+        # Unsigned URLs fall back to the bearer token and an Image lookup. The
+        # token is only resolved here so signed requests never pay for it.
+        user = await deps.verify_jwt_to_uuid_or_none(
+            await deps.optional_oauth2_scheme(request)
+        )
         user_id = user.id if user is not None else ""
-        db_image = db.query(Image).filter(Image.id == image_id).first()
+        access = await load_image_access(db, image_id)
         if (
-            (not db_image)
-            or ((not db_image.public) and (db_image.owner_id != user_id))
-            or (not db_image.uploaded)
+            (not access)
+            or ((not access.public) and (access.owner_id != user_id))
+            or (not access.uploaded)
         ):
-            return JSONResponse(
+            return ORJSONResponse(
                 {"success": False, "detail": "Image not found"}, status_code=404
             )
 
-        return FileResponse(db_image.path, media_type=db_image.content_type)
+        if variant == "jpg":
+            path, media_type = access.path, access.content_type
+        else:
+            path, media_type = f"{os.path.splitext(access.path)[0]}.{variant}", None
+
+        return await serve_local_image(
+            request,
+            path,
+            media_type,
+            # Private images may only be reused after re-checking access
+            (
+                f"public, max-age={settings.MEDIA_CACHE_MAX_AGE}, immutable"
+                if access.public
+                else "private, no-cache"
+            ),
+        )
     except Exception as e:
-        return JSONResponse(
+        return ORJSONResponse(
             {
                 "success": False,
                 "detail": str(e) if settings.DEBUG else "Internal server error",
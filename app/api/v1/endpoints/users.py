@@ -1,8 +1,9 @@
 import uuid
 
 from fastapi import APIRouter, Depends
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api import deps
 from app.core.config import settings
@@ -20,21 +21,21 @@ async def users_me(current_user: UserDetail = Depends(deps.get_current_user)):
 # get user details from id
 @router.get("/profile/{user}")
 async def users_username_from_id(
-    user: uuid.UUID, db: Session = Depends(deps.get_db)
-) -> JSONResponse:
+    user: uuid.UUID, db: AsyncSession = Depends(deps.get_db)
+) -> ORJSONResponse:
     try:
-        db_user = db.query(User).filter(User.id == user).first()
+        db_user = await db.scalar(select(User).where(User.id == user))
         if not db_user:
-            return JSONResponse(
+            return ORJSONResponse(
                 content={"success": False, "detail": "User not found"},
                 status_code=404,
             )
 
-        return JSONResponse(
+        return ORJSONResponse(
             content={"success": True, "username": db_user.username, "bio": db_user.bio}
         )
     except Exception as e:
-        return JSONResponse(
+        return ORJSONResponse(
             {
                 "success": False,
                 "detail": str(e) if settings.DEBUG else "Internal server error",
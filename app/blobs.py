@@ -0,0 +1,194 @@
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List, Optional
+import uuid
+
+from sqlalchemy import Row, delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.ext.storage import StorageBackend
+from app.models.blob import Blob
+from app.models.image import Image
+from app.models.retired_upload import RetiredUpload
+
+# Copied from a blob onto each Image that references it
+BLOB_METADATA = ("variants", "width", "height", "orientation", "blurhash")
+
+
+async def lock_blob(db: AsyncSession, sha256: str) -> None:
+    # Serializes every claim and release of one content hash until the
+    # surrounding transaction ends, including concurrent uploads of it
+    await db.execute(select(func.pg_advisory_xact_lock(int(sha256[:15], 16))))
+
+
+@dataclass(slots=True)
+class BlobClaim:
+    """A blob claimed for an image, and the storage work left to do for it.
+
+    Call finish_blob_claim once the claiming transaction has committed, or
+    abandon_blob_claim if it didn't, so that no object outlives the rows
+    referencing it.
+    """
+
+    blob: Blob
+    created: bool
+    # The upload's own object, no longer referenced once the image points at
+    # the blob. Retired ones are deleted later, see RetiredUpload.
+    upload_path: Optional[str] = None
+    retired: bool = False
+
+
+async def lock_image(db: AsyncSession, image_id: uuid.UUID) -> Optional[Image]:
+    # Row-locks an image before it is released, taking its blob lock first,
+    # the order claim_blob and update_blob_metadata use too
+    while True:
+        sha256 = await db.scalar(select(Image.blob_sha256).where(Image.id == image_id))
+        if sha256 is not None:
+            await lock_blob(db, sha256)
+        db_image = await db.scalar(
+            select(Image)
+            .where(Image.id == image_id)
+            .with_for_update()
+            .execution_options(populate_existing=True)
+        )
+        if db_image is None or db_image.blob_sha256 == sha256:
+            return db_image
+        # Claimed between the two reads: start over to lock its blob first
+        await db.rollback()
+
+
+async def claim_blob(
+    db: AsyncSession,
+    storage: StorageBackend,
+    db_image: Image,
+    sha256: str,
+    size: int,
+    data: Optional[bytes] = None,
+) -> Optional[BlobClaim]:
+    """Points `db_image` at the blob for its content, creating it if needed.
+
+    A new blob is written from `data` when given, or else copied from the
+    upload at `db_image.path`. Returns None if the image has been deleted,
+    and otherwise a claim whose `created` says whether the blob's derivatives
+    still need rendering. The caller must commit to release the locks.
+    """
+    await lock_blob(db, sha256)
+    # Locked against images_delete, and refreshed in case another job
+    # claimed this upload while we were hashing it
+    locked = await db.scalar(
+        select(Image)
+        .where(Image.id == db_image.id)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    )
+    if locked is None:
+        return None
+    if db_image.blob_sha256 is not None:
+        blob = await db.get(Blob, (db_image.blob_sha256, db_image.public))
+        return BlobClaim(blob, False)
+
+    upload_path = db_image.path
+    blob = await db.get(Blob, (sha256, db_image.public))
+
+    created = blob is None
+    if created:
+        blob_path = storage.blob_path(sha256, db_image.public)
+        if data is not None:
+            await asyncio.to_thread(storage.write, blob_path, data, "image/jpeg")
+        else:
+            await asyncio.to_thread(storage.copy, upload_path, blob_path)
+        blob = Blob(sha256=sha256, public=db_image.public, path=blob_path, size=size)
+        db.add(blob)
+    else:
+        blob.refcount += 1
+        for column in BLOB_METADATA:
+            if getattr(blob, column) is not None:
+                setattr(db_image, column, getattr(blob, column))
+
+    db_image.path = blob.path
+    db_image.blob_sha256 = sha256
+    # A confirmed image has been served from its upload, so URLs signed for
+    # it may still be in use; an unconfirmed one's upload was never served
+    retired = db_image.uploaded
+    if retired:
+        retention = settings.UPLOAD_RETENTION_SECONDS
+        if retention is None:
+            retention = 2 * settings.CLOUDFRONT_PRESIGNED_URL_EXPIRY
+        db.add(
+            RetiredUpload(
+                path=upload_path,
+                image_id=db_image.id,
+                delete_after=datetime.utcnow() + timedelta(seconds=retention),
+            )
+        )
+    return BlobClaim(blob, created, upload_path, retired)
+
+
+async def finish_blob_claim(storage: StorageBackend, claim: BlobClaim) -> None:
+    if claim.upload_path is not None and not claim.retired:
+        await asyncio.to_thread(storage.delete, claim.upload_path)
+
+
+async def abandon_blob_claim(storage: StorageBackend, claim: BlobClaim) -> None:
+    # Nothing references a blob object written by a claim that rolled back
+    if claim.created:
+        await asyncio.to_thread(storage.delete, claim.blob.path)
+
+
+async def update_blob_metadata(
+    db: AsyncSession, sha256: str, public: bool, **values
+) -> List[Row]:
+    # Under the lock, so an Image claiming the blob concurrently either
+    # already sees these values or is committed before they are copied
+    await lock_blob(db, sha256)
+    await db.execute(
+        update(Blob)
+        .where(Blob.sha256 == sha256, Blob.public == public)
+        .values(**values)
+    )
+    # The updated images, so callers can invalidate their feed pages
+    result = await db.execute(
+        update(Image)
+        .where(Image.blob_sha256 == sha256, Image.public == public)
+        .values(**values)
+        .returning(Image.id, Image.owner_id, Image.created_at, Image.public)
+    )
+    return result.all()
+
+
+async def release_image(db: AsyncSession, db_image: Image) -> List[str]:
+    """Deletes `db_image` and drops its blob reference.
+
+    Returns the paths that are no longer referenced once the caller commits.
+    They must only be deleted after that commit succeeds.
+    """
+    paths: List[str] = []
+    blob: Optional[Blob] = None
+    if db_image.blob_sha256 is not None:
+        await lock_blob(db, db_image.blob_sha256)
+        blob = await db.get(Blob, (db_image.blob_sha256, db_image.public))
+
+    if blob is None:
+        paths.append(db_image.path)
+        paths.extend(variant["path"] for variant in (db_image.variants or {}).values())
+    # Its retired upload goes too, rather than outliving the image
+    paths.extend(
+        await db.scalars(
+            delete(RetiredUpload)
+            .where(RetiredUpload.image_id == db_image.id)
+            .returning(RetiredUpload.path)
+        )
+    )
+
+    await db.delete(db_image)
+    if blob is not None:
+        blob.refcount -= 1
+        if blob.refcount <= 0:
+            paths.append(blob.path)
+            paths.extend(variant["path"] for variant in (blob.variants or {}).values())
+            # Flush the Image delete first, since it references the blob
+            await db.flush()
+            await db.delete(blob)
+    return paths
@@ -1,6 +1,6 @@
 from datetime import timedelta
 import secrets
-from typing import Optional
+from typing import Dict, List, Literal, Optional
 
 from pydantic import PostgresDsn, field_validator
 from pydantic_core.core_schema import ValidationInfo
@@ -10,6 +10,9 @@ from pydantic_settings import BaseSettings
 class Settings(BaseSettings):
     PRODUCTION: bool = True
     DEBUG: bool = False
+    # Serves internal cache and hasher counters at /health/stats; off by
+    # default since they help anyone probing the service's load
+    HEALTH_STATS_ENABLED: bool = False
 
     PROJECT_NAME: str = "yoctogram"
 
@@ -28,10 +31,71 @@ class Settings(BaseSettings):
 
     JWT_ALGORITHM: str = "HS256"
 
+    TOKEN_CACHE_ENTRIES: int = 50_000
+    TOKEN_CACHE_TTL_SECONDS: int = 60 * 15
+    USER_CACHE_ENTRIES: int = 50_000
+    USER_CACHE_TTL_SECONDS: int = 60
+    IMAGE_ACCESS_CACHE_ENTRIES: int = 200_000
+    IMAGE_ACCESS_CACHE_TTL_SECONDS: int = 60
+    IMAGE_ACCESS_NEGATIVE_CACHE_TTL_SECONDS: int = 10
+
+    PASSWORD_HASH_WORKERS: int = 4
+    # Hashes allowed to wait for a worker before logins are shed with a 503
+    PASSWORD_HASH_QUEUE_SIZE: int = 32
+
     CHUNK_SIZE: int = 2048
+    UPLOAD_BUFFER_SIZE: int = 1024 * 1024
+    MAX_IMAGE_BYTES: int = 10 * 1000 * 1000
     IMAGE_PAGINATION: int = 100
+    # Rendered pages of public images; FEED_CACHE_URL (redis://...) shares them
+    # between workers, otherwise each process keeps its own
+    FEED_CACHE_ENABLED: bool = True
+    FEED_CACHE_URL: Optional[str] = None
+    FEED_CACHE_ENTRIES: int = 10_000
+    # Bounds how stale the per-process cache gets when an invalidation
+    # broadcast from another process is lost
+    FEED_CACHE_TTL_SECONDS: int = 60
+    # Edge caches purge anonymous feed responses by their Surrogate-Key tags;
+    # unset skips purging. Headers is a JSON object, e.g. for an API token.
+    SURROGATE_PURGE_URL: Optional[str] = None
+    SURROGATE_PURGE_HEADERS: Dict[str, str] = {}
+    SURROGATE_PURGE_TIMEOUT_SECONDS: float = 5.0
+    # Server-sent events for newly confirmed images, fanned out across workers
+    # with Postgres LISTEN/NOTIFY
+    FEED_STREAM_ENABLED: bool = True
+    FEED_STREAM_QUEUE_SIZE: int = 64
+    FEED_STREAM_HEARTBEAT_SECONDS: int = 15
+    # Streams end after this long and clients reconnect, so open connections
+    # don't hold up a graceful shutdown and rebalance across workers
+    FEED_STREAM_MAX_SECONDS: int = 300
+    FEED_STREAM_RECONNECT_SECONDS: float = 1.0
+    # Derivatives rendered after an upload is confirmed; empty disables them
+    IMAGE_VARIANT_SIZES: List[int] = [150, 640, 1080]
+    IMAGE_VARIANT_FORMAT: Literal["jpeg", "webp"] = "jpeg"
+    IMAGE_VARIANT_WORKERS: int = 2
+    UPLOAD_BATCH_MAX_COUNT: int = 50
+    UPLOAD_CONFIRM_CONCURRENCY: int = 16
+    MEDIA_BATCH_MAX_COUNT: int = 100
+
+    # Sweeps un-confirmed upload slots long after their presigned POST expired,
+    # and deletes retired uploads once UPLOAD_RETENTION_SECONDS have passed
+    UPLOAD_RECONCILER_ENABLED: bool = False
+    UPLOAD_RECONCILER_STALE_AFTER_SECONDS: int = int(timedelta(days=1).total_seconds())
+    UPLOAD_RECONCILER_BATCH_SIZE: int = 500
+    UPLOAD_RECONCILER_BATCH_INTERVAL_SECONDS: float = 1.0
+    UPLOAD_RECONCILER_SWEEP_INTERVAL_SECONDS: int = int(
+        timedelta(hours=1).total_seconds()
+    )
+    # How long an upload outlives its move into a blob before the reconciler
+    # deletes it. Defaults to the longest a URL signed for it stays valid,
+    # twice CLOUDFRONT_PRESIGNED_URL_EXPIRY.
+    UPLOAD_RETENTION_SECONDS: Optional[int] = None
 
+    # Defaults to "s3" in production and "filesystem" otherwise
+    STORAGE_BACKEND: Optional[Literal["filesystem", "s3"]] = None
     LOCAL_UPLOAD_DIR: str = "/uploads"
+    # Cache lifetime for public images served from LOCAL_UPLOAD_DIR
+    MEDIA_CACHE_MAX_AGE: int = int(timedelta(days=365).total_seconds())
 
     AWS_DEFAULT_REGION: str = "us-west-2"
 
@@ -41,7 +105,18 @@ class Settings(BaseSettings):
     PUBLIC_IMAGES_CLOUDFRONT_DISTRIBUTION: str = None
     PRIVATE_IMAGES_CLOUDFRONT_DISTRIBUTION: str = None
 
+    # Additional buckets per privacy class, as a JSON object mapping bucket name
+    # to the CloudFront distribution in front of it. New objects are spread
+    # across the primary and extra buckets by a hash of the image id.
+    PUBLIC_IMAGES_EXTRA_BUCKETS: Dict[str, str] = {}
+    PRIVATE_IMAGES_EXTRA_BUCKETS: Dict[str, str] = {}
+    # Hex characters of hash prepended to new object keys, e.g. 2 gives
+    # "ab/YYYY/M/D/<id>" across 256 prefixes; 0 keeps "YYYY/M/D/<id>"
+    S3_KEY_SHARD_CHARS: int = 0
+
     CLOUDFRONT_PRESIGNED_URL_EXPIRY: int = int(timedelta(days=7).total_seconds())
+    PRESIGNED_URL_CACHE_ENTRIES: int = 100_000
+    PRESIGNED_URL_CACHE_BYTES: int = 64 * 1024 * 1024
 
     @field_validator("SQLALCHEMY_DATABASE_URI", mode="before")
     @classmethod
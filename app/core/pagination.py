@@ -0,0 +1,18 @@
+import base64
+from datetime import datetime
+from typing import Tuple
+import uuid
+
+
+def encode_cursor(created_at: datetime, image_id: uuid.UUID) -> str:
+    raw = f"{created_at.isoformat()}|{image_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, image_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(created_at), uuid.UUID(image_id)
+    except ValueError as exc:
+        raise ValueError("Invalid cursor") from exc
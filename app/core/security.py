@@ -1,5 +1,12 @@
+import asyncio
+import base64
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Any, Union
+import hashlib
+import hmac
+import threading
+from time import perf_counter, time
+from typing import Any, Callable, Dict, TypeVar, Union
 
 from jose import jwt
 from passlib.context import CryptContext
@@ -8,6 +15,8 @@ from app.core.config import settings
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+T = TypeVar("T")
+
 
 ALGORITHM = "HS256"
 
@@ -32,3 +41,103 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
+
+
+# Derived from SECRET_KEY but distinct from the JWT key, so a media URL
+# signature can never be replayed as anything else
+_media_url_key = hmac.new(
+    settings.SECRET_KEY.encode(), b"local-media-url", hashlib.sha256
+).digest()
+
+
+def sign_media_url(image_id: str, expires: int, public: bool, file: str) -> str:
+    message = f"{image_id}:{expires}:{int(public)}:{file}".encode()
+    digest = hmac.new(_media_url_key, message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def verify_media_url(
+    image_id: str, expires: int, public: bool, file: str, signature: str
+) -> bool:
+    if expires < time():
+        return False
+    return hmac.compare_digest(
+        sign_media_url(image_id, expires, public, file), signature
+    )
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    """Runs bcrypt off the event loop on a dedicated, bounded thread pool.
+
+    bcrypt releases the GIL while hashing, so threads give real parallelism.
+    Work beyond the pool size waits in a queue of at most `queue_size` entries;
+    past that, callers are rejected immediately so that a login storm sheds
+    load instead of stalling every other request on the worker.
+    """
+
+    def __init__(self, workers: int, queue_size: int):
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="password-hasher"
+        )
+        self._max_pending = workers + queue_size
+        self._workers = workers
+        # Only touched from the event loop thread
+        self._pending = 0
+        self._stats_lock = threading.Lock()
+        self.rejected = 0
+        self.completed = 0
+        self.hash_seconds_total = 0.0
+        self.hash_seconds_max = 0.0
+
+    def _timed(self, fn: Callable[..., T], *args: Any) -> T:
+        start = perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = perf_counter() - start
+            with self._stats_lock:
+                self.completed += 1
+                self.hash_seconds_total += elapsed
+                self.hash_seconds_max = max(self.hash_seconds_max, elapsed)
+
+    async def _run(self, fn: Callable[..., T], *args: Any) -> T:
+        if self._pending >= self._max_pending:
+            self.rejected += 1
+            raise PasswordHasherBusy()
+
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._timed, fn, *args
+            )
+        finally:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(get_password_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            completed = self.completed
+            total = self.hash_seconds_total
+            slowest = self.hash_seconds_max
+        return {
+            "in_flight": min(self._pending, self._workers),
+            "queue_depth": max(self._pending - self._workers, 0),
+            "rejected": self.rejected,
+            "completed": completed,
+            "hash_ms_avg": round(total / completed * 1000, 2) if completed else 0.0,
+            "hash_ms_max": round(slowest * 1000, 2),
+        }
+
+
+password_hasher = PasswordHasher(
+    settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_QUEUE_SIZE
+)
@@ -1,9 +1,23 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 from app.core.config import settings
 
+# Synchronous engine, used by Alembic and app/prestart.py
 engine = create_engine(
     settings.SQLALCHEMY_DATABASE_URI.unicode_string(), pool_pre_ping=True
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Request handlers use asyncpg so database round-trips don't block the event loop
+async_engine = create_async_engine(
+    make_url(settings.SQLALCHEMY_DATABASE_URI.unicode_string()).set(
+        drivername="postgresql+asyncpg"
+    ),
+    pool_pre_ping=True,
+)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
@@ -0,0 +1,26 @@
+import asyncio
+from typing import Sequence
+import urllib.request
+
+from app.core.config import settings
+
+
+def post_surrogate_purge(keys: Sequence[str]) -> None:
+    # Keys go space-separated in a Surrogate-Key header, which is what
+    # Fastly's batch purge expects; other CDNs can sit behind a small relay
+    request = urllib.request.Request(
+        settings.SURROGATE_PURGE_URL,
+        method="POST",
+        headers=settings.SURROGATE_PURGE_HEADERS | {"Surrogate-Key": " ".join(keys)},
+    )
+    with urllib.request.urlopen(
+        request, timeout=settings.SURROGATE_PURGE_TIMEOUT_SECONDS
+    ):
+        pass
+
+
+async def purge_surrogate_keys(keys: Sequence[str]) -> None:
+    # Purges every edge-cached response tagged with any of `keys`
+    if not settings.SURROGATE_PURGE_URL or not keys:
+        return
+    await asyncio.to_thread(post_surrogate_purge, keys)
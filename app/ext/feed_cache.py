@@ -0,0 +1,287 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+import logging
+import threading
+from time import monotonic
+from typing import Dict, Iterable, List, Optional, Tuple
+import uuid
+
+import redis.asyncio as redis
+
+from app.core.config import settings
+from app.ext.cdn import purge_surrogate_keys
+
+logger = logging.getLogger(__name__)
+
+
+def feed_position(created_at: datetime, image_id: uuid.UUID | str) -> str:
+    # Sorts like the feed's (created_at, id) keyset: fixed-width timestamps,
+    # and canonical UUID strings order the same way Postgres orders uuids
+    return f"{created_at:%Y-%m-%dT%H:%M:%S.%f}/{image_id}"
+
+
+class FeedCacheBackend(ABC):
+    """Stores rendered feed pages, each covering a range of feed positions.
+
+    A page is cached with the positions it covers, `lower` (inclusive) to
+    `upper` (exclusive), where None means unbounded. Invalidating a position
+    drops exactly the pages of that scope whose range contains it. Every
+    invalidation also bumps the scope's version, and a page rendered from a
+    query that started before the bump is not stored, so a slow request can
+    never write back a page that was already stale.
+    """
+
+    @abstractmethod
+    async def get(self, scope: str, key: str) -> Optional[bytes]: ...
+
+    @abstractmethod
+    async def version(self, scope: str) -> int: ...
+
+    @abstractmethod
+    async def put(
+        self,
+        scope: str,
+        key: str,
+        version: int,
+        lower: Optional[str],
+        upper: Optional[str],
+        value: bytes,
+    ) -> None: ...
+
+    @abstractmethod
+    async def invalidate(self, scope: str, position: str) -> None: ...
+
+    async def validator(self, scope: str) -> str:
+        # Changes whenever the scope does, for the feed's ETags
+        return str(await self.version(scope))
+
+
+class MemoryFeedCache(FeedCacheBackend):
+    """Feed cache local to this process.
+
+    Writes from other workers and CLIs reach it as invalidations broadcast
+    by app.invalidation. Pages also expire after `ttl` seconds, which bounds
+    how long a write goes unseen if its broadcast is lost.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._pages: OrderedDict[Tuple[str, str], Tuple[bytes, float]] = OrderedDict()
+        self._bounds: Dict[str, Dict[str, Tuple[Optional[str], Optional[str]]]] = {}
+        self._versions: Dict[str, int] = {}
+        # Versions count from zero in every process, so alone they would
+        # match another worker's, or a restarted one's, for different pages
+        self._instance = uuid.uuid4().hex
+
+    async def get(self, scope: str, key: str) -> Optional[bytes]:
+        entry = self._pages.get((scope, key))
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= monotonic():
+            self._remove(scope, key)
+            return None
+        self._pages.move_to_end((scope, key))
+        return value
+
+    async def version(self, scope: str) -> int:
+        return self._versions.get(scope, 0)
+
+    async def validator(self, scope: str) -> str:
+        # Also rolled over every `ttl`, so after a lost invalidation ETags
+        # stop matching about as soon as the stale pages expire
+        epoch = int(monotonic() // self.ttl)
+        return f"{self._instance}.{epoch}.{self._versions.get(scope, 0)}"
+
+    async def put(
+        self,
+        scope: str,
+        key: str,
+        version: int,
+        lower: Optional[str],
+        upper: Optional[str],
+        value: bytes,
+    ) -> None:
+        if self._versions.get(scope, 0) != version:
+            return
+        self._pages[(scope, key)] = (value, monotonic() + self.ttl)
+        self._pages.move_to_end((scope, key))
+        self._bounds.setdefault(scope, {})[key] = (lower, upper)
+        while len(self._pages) > self.max_entries:
+            evicted_scope, evicted = next(iter(self._pages))
+            self._remove(evicted_scope, evicted)
+
+    async def invalidate(self, scope: str, position: str) -> None:
+        self._versions[scope] = self._versions.get(scope, 0) + 1
+        bounds = self._bounds.get(scope, {})
+        for key, (lower, upper) in list(bounds.items()):
+            if (lower is None or position >= lower) and (
+                upper is None or position < upper
+            ):
+                self._remove(scope, key)
+
+    def _remove(self, scope: str, key: str) -> None:
+        del self._pages[(scope, key)]
+        bounds = self._bounds[scope]
+        del bounds[key]
+        if not bounds:
+            del self._bounds[scope]
+
+
+# Both scripts run atomically on the server, which is what makes the version
+# check and the range scan safe against other workers
+
+PUT_SCRIPT = """
+if (redis.call('GET', KEYS[1]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[2], ARGV[3], 'EX', ARGV[4])
+redis.call('HSET', KEYS[3], KEYS[2], ARGV[2])
+redis.call('EXPIRE', KEYS[3], ARGV[4])
+return 1
+"""
+
+INVALIDATE_SCRIPT = """
+redis.call('INCR', KEYS[1])
+local pages = redis.call('HGETALL', KEYS[2])
+for i = 1, #pages, 2 do
+    local key, bounds = pages[i], pages[i + 1]
+    local separator = string.find(bounds, ' ', 1, true)
+    local lower = string.sub(bounds, 1, separator - 1)
+    local upper = string.sub(bounds, separator + 1)
+    if (lower == '' or ARGV[1] >= lower) and (upper == '' or ARGV[1] < upper) then
+        redis.call('DEL', key)
+        redis.call('HDEL', KEYS[2], key)
+    elseif redis.call('EXISTS', key) == 0 then
+        redis.call('HDEL', KEYS[2], key)
+    end
+end
+return 1
+"""
+
+
+class RedisFeedCache(FeedCacheBackend):
+    """Feed cache shared by every worker through a Redis-protocol server.
+
+    All keys of a scope share a hash tag, so the scripts also work on a
+    cluster. Pages expire after two signing windows, by which point nothing
+    requests them any more; that only reclaims memory, since the window is
+    part of every page key.
+    """
+
+    def __init__(self, client: redis.Redis):
+        self.client = client
+        self.ttl = 2 * settings.CLOUDFRONT_PRESIGNED_URL_EXPIRY
+        self._put = client.register_script(PUT_SCRIPT)
+        self._invalidate = client.register_script(INVALIDATE_SCRIPT)
+
+    @staticmethod
+    def _keys(scope: str) -> Tuple[str, str]:
+        return f"feed:{{{scope}}}:version", f"feed:{{{scope}}}:pages"
+
+    @staticmethod
+    def _page_key(scope: str, key: str) -> str:
+        return f"feed:{{{scope}}}:page:{key}"
+
+    async def get(self, scope: str, key: str) -> Optional[bytes]:
+        return await self.client.get(self._page_key(scope, key))
+
+    async def version(self, scope: str) -> int:
+        version_key, _ = self._keys(scope)
+        return int(await self.client.get(version_key) or 0)
+
+    async def put(
+        self,
+        scope: str,
+        key: str,
+        version: int,
+        lower: Optional[str],
+        upper: Optional[str],
+        value: bytes,
+    ) -> None:
+        version_key, pages_key = self._keys(scope)
+        await self._put(
+            keys=[version_key, self._page_key(scope, key), pages_key],
+            args=[version, f"{lower or ''} {upper or ''}", value, self.ttl],
+        )
+
+    async def invalidate(self, scope: str, position: str) -> None:
+        await self._invalidate(keys=list(self._keys(scope)), args=[position])
+
+
+_feed_cache: Optional[FeedCacheBackend] = None
+_feed_cache_lock = threading.Lock()
+
+
+def get_feed_cache() -> Optional[FeedCacheBackend]:
+    global _feed_cache
+    if not settings.FEED_CACHE_ENABLED:
+        return None
+    if _feed_cache is None:
+        with _feed_cache_lock:
+            if _feed_cache is None:
+                if settings.FEED_CACHE_URL:
+                    _feed_cache = RedisFeedCache(
+                        redis.from_url(settings.FEED_CACHE_URL)
+                    )
+                else:
+                    _feed_cache = MemoryFeedCache(
+                        settings.FEED_CACHE_ENTRIES, settings.FEED_CACHE_TTL_SECONDS
+                    )
+    return _feed_cache
+
+
+LATEST_FEED_SCOPE = "latest"
+
+
+def user_feed_scope(owner_id: uuid.UUID | str) -> str:
+    return f"by_user:{owner_id}"
+
+
+def private_feed_scope(owner_id: uuid.UUID | str) -> str:
+    # Never holds pages; its version only validates an owner's merged feeds
+    return f"private:{owner_id}"
+
+
+def feed_surrogate_key(scope: str) -> str:
+    # Tags edge-cached responses of a feed scope, see purge_surrogate_keys
+    return f"feed:{scope}"
+
+
+async def invalidate_feed_image(
+    owner_id: uuid.UUID | str,
+    created_at: datetime,
+    image_id: uuid.UUID | str,
+    public: bool = True,
+) -> List[str]:
+    # Call after committing any change to an image that the feed shows:
+    # confirmation, deletion, or a new path, variants or metadata. Private
+    # images are never cached, only their owner's version is bumped. Returns
+    # the surrogate keys to hand to purge_feed_keys.
+    if public:
+        scopes = [LATEST_FEED_SCOPE, user_feed_scope(owner_id)]
+    else:
+        scopes = [private_feed_scope(owner_id)]
+    feed_cache = get_feed_cache()
+    if feed_cache is not None:
+        position = feed_position(created_at, image_id)
+        try:
+            for scope in scopes:
+                await feed_cache.invalidate(scope, position)
+        except Exception:
+            logger.exception("Could not invalidate feed pages for image %s", image_id)
+    if not public:
+        return []
+    return [feed_surrogate_key(scope) for scope in scopes]
+
+
+async def purge_feed_keys(keys: Iterable[str]) -> None:
+    # Once per request or batch, and only after the origin's own cache was
+    # invalidated, so the edge can't refetch a stale page
+    keys = sorted(set(keys))
+    try:
+        await purge_surrogate_keys(keys)
+    except Exception:
+        logger.exception("Could not purge edge-cached feeds %s", " ".join(keys))
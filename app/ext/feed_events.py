@@ -0,0 +1,145 @@
+import asyncio
+from dataclasses import dataclass
+import logging
+from typing import Awaitable, Callable, Optional, Set
+import uuid
+
+import asyncpg
+import orjson
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.session import async_engine
+
+logger = logging.getLogger(__name__)
+
+FEED_CHANNEL = "feed_images"
+# Cache invalidations, see app.invalidation
+FEED_INVALIDATION_CHANNEL = "feed_invalidations"
+
+
+@dataclass(eq=False)
+class FeedSubscriber:
+    # Receives rendered events, or None once the stream should end
+    queue: asyncio.Queue
+    user_id: Optional[str] = None
+    creator: Optional[str] = None
+
+
+class FeedHub:
+    """Fans newly confirmed images out to this worker's stream subscribers.
+
+    Every subscriber has a bounded queue. One that falls a whole queue behind
+    is disconnected rather than buffered without limit or allowed to hold up
+    everyone else; clients reconnect and catch up with /feed/latest?after=.
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._subscribers: Set[FeedSubscriber] = set()
+
+    def subscribe(
+        self, user_id: Optional[str] = None, creator: Optional[str] = None
+    ) -> FeedSubscriber:
+        subscriber = FeedSubscriber(asyncio.Queue(self.queue_size), user_id, creator)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: FeedSubscriber) -> None:
+        self._subscribers.discard(subscriber)
+
+    def wants(self, owner_id: str, public: bool) -> bool:
+        return any(
+            self._accepts(subscriber, owner_id, public)
+            for subscriber in self._subscribers
+        )
+
+    def publish(self, owner_id: str, public: bool, data: bytes) -> None:
+        for subscriber in list(self._subscribers):
+            if not self._accepts(subscriber, owner_id, public):
+                continue
+            try:
+                subscriber.queue.put_nowait(data)
+            except asyncio.QueueFull:
+                self._drop(subscriber)
+
+    @staticmethod
+    def _accepts(subscriber: FeedSubscriber, owner_id: str, public: bool) -> bool:
+        if subscriber.creator is not None and subscriber.creator != owner_id:
+            return False
+        return public or subscriber.user_id == owner_id
+
+    def _drop(self, subscriber: FeedSubscriber) -> None:
+        # Discard its backlog so the end-of-stream marker is seen right away
+        self._subscribers.discard(subscriber)
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+
+
+feed_hub = FeedHub(settings.FEED_STREAM_QUEUE_SIZE)
+
+
+async def notify_image_confirmed(
+    db: AsyncSession, image_id: uuid.UUID, owner_id: uuid.UUID, public: bool
+) -> None:
+    # Issued inside the confirming transaction: Postgres only delivers the
+    # notification on commit, to every worker listening on FEED_CHANNEL
+    if not settings.FEED_STREAM_ENABLED:
+        return
+    payload = orjson.dumps(
+        {"id": str(image_id), "owner_id": str(owner_id), "public": public}
+    ).decode()
+    await db.execute(select(func.pg_notify(FEED_CHANNEL, payload)))
+
+
+ImageHandler = Callable[[str, str, bool], Awaitable[None]]
+InvalidationHandler = Callable[[str], Awaitable[None]]
+
+
+async def listen_for_feed_events(
+    on_image: Optional[ImageHandler], on_invalidation: InvalidationHandler
+) -> None:
+    # Runs for the life of the worker, reconnecting if the connection drops.
+    # Confirmed images are only listened for when on_image is given.
+    # A dedicated connection, outside the pool, with the engine's own arguments
+    args, kwargs = async_engine.dialect.create_connect_args(async_engine.url)
+    handlers: Set[asyncio.Task] = set()
+
+    def spawn(handler: Awaitable[None]) -> None:
+        task = asyncio.create_task(handler)
+        # The loop only keeps weak references to tasks
+        handlers.add(task)
+        task.add_done_callback(handlers.discard)
+
+    while True:
+        connection = None
+        try:
+            connection = await asyncpg.connect(*args, **kwargs)
+            lost = asyncio.Event()
+            connection.add_termination_listener(lambda _: lost.set())
+
+            def on_image_notification(_connection, _pid, _channel, payload: str):
+                event = orjson.loads(payload)
+                # Nothing to render when no subscriber here wants it
+                if feed_hub.wants(event["owner_id"], event["public"]):
+                    spawn(on_image(event["id"], event["owner_id"], event["public"]))
+
+            def on_invalidation_notification(_connection, _pid, _channel, payload):
+                spawn(on_invalidation(payload))
+
+            await connection.add_listener(
+                FEED_INVALIDATION_CHANNEL, on_invalidation_notification
+            )
+            if on_image is not None:
+                await connection.add_listener(FEED_CHANNEL, on_image_notification)
+            await lost.wait()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Feed event listener failed: %s", e)
+        finally:
+            if connection is not None and not connection.is_closed():
+                await connection.close()
+        await asyncio.sleep(settings.FEED_STREAM_RECONNECT_SECONDS)
@@ -0,0 +1,157 @@
+from dataclasses import dataclass
+import io
+import math
+from typing import List, Optional, Sequence
+
+from PIL import Image as PILImage, ImageOps
+
+from app.ext.jpeg import JpegHeader, strip_jpeg_metadata
+
+# Only Pillow and the standard library are imported here: these functions run
+# in worker processes, which should not have to load the web app to start
+
+VARIANT_FORMATS = {
+    "jpeg": ("jpg", "image/jpeg"),
+    "webp": ("webp", "image/webp"),
+}
+
+BLURHASH_CHARACTERS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+BLURHASH_SAMPLE_SIZE = 32
+SRGB_TO_LINEAR = [
+    c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+    for c in (v / 255 for v in range(256))
+]
+
+
+@dataclass
+class RenderedVariant:
+    name: str
+    extension: str
+    content_type: str
+    width: int
+    height: int
+    data: bytes
+
+
+@dataclass
+class ProcessedImage:
+    header: Optional[JpegHeader]
+    blurhash: str
+    variants: List[RenderedVariant]
+
+
+def encode_base83(value: int, length: int) -> str:
+    return "".join(
+        BLURHASH_CHARACTERS[value // 83 ** (length - i - 1) % 83] for i in range(length)
+    )
+
+
+def linear_to_srgb(value: float) -> int:
+    value = max(0.0, min(1.0, value))
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def compute_blurhash(
+    image: PILImage.Image, x_components: int = 4, y_components: int = 3
+) -> str:
+    # https://github.com/woltapp/blurhash/blob/master/Algorithm.md, computed
+    # on a tiny copy since the placeholder has no detail to lose
+    sample = image.convert("RGB")
+    sample.thumbnail((BLURHASH_SAMPLE_SIZE, BLURHASH_SAMPLE_SIZE), PILImage.BILINEAR)
+    width, height = sample.size
+    data = sample.tobytes()
+    pixels = [
+        (
+            SRGB_TO_LINEAR[data[i]],
+            SRGB_TO_LINEAR[data[i + 1]],
+            SRGB_TO_LINEAR[data[i + 2]],
+        )
+        for i in range(0, len(data), 3)
+    ]
+
+    factors = []
+    for j in range(y_components):
+        cos_y = [math.cos(math.pi * j * y / height) for y in range(height)]
+        for i in range(x_components):
+            cos_x = [math.cos(math.pi * i * x / width) for x in range(width)]
+            r = g = b = 0.0
+            for y in range(height):
+                row = y * width
+                for x in range(width):
+                    basis = cos_x[x] * cos_y[y]
+                    pr, pg, pb = pixels[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = (1 if i == j == 0 else 2) / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    blurhash = encode_base83((x_components - 1) + (y_components - 1) * 9, 1)
+
+    max_value = 1.0
+    if ac:
+        actual_max = max(abs(c) for factor in ac for c in factor)
+        quantized_max = max(0, min(82, int(actual_max * 166 - 0.5)))
+        max_value = (quantized_max + 1) / 166
+        blurhash += encode_base83(quantized_max, 1)
+    else:
+        blurhash += encode_base83(0, 1)
+
+    blurhash += encode_base83(
+        (linear_to_srgb(dc[0]) << 16)
+        + (linear_to_srgb(dc[1]) << 8)
+        + linear_to_srgb(dc[2]),
+        4,
+    )
+
+    def quantize(value: float) -> int:
+        scaled = math.copysign(abs(value / max_value) ** 0.5, value)
+        return max(0, min(18, int(scaled * 9 + 9.5)))
+
+    for r, g, b in ac:
+        blurhash += encode_base83(
+            quantize(r) * 19 * 19 + quantize(g) * 19 + quantize(b), 2
+        )
+    return blurhash
+
+
+def process_original(
+    original: bytes, sizes: Sequence[int], image_format: str
+) -> ProcessedImage:
+    stripped, header = strip_jpeg_metadata(original)
+    extension, content_type = VARIANT_FORMATS[image_format]
+    with PILImage.open(io.BytesIO(stripped)) as source:
+        # Let the JPEG decoder downscale by up to 8x while decoding, which is
+        # far cheaper than decoding at full resolution and resizing
+        target = max(sizes, default=BLURHASH_SAMPLE_SIZE)
+        source.draft("RGB", (target, target))
+        image = ImageOps.exif_transpose(source).convert("RGB")
+
+    variants = []
+    # Largest first, so each smaller variant is resized from the previous one
+    for size in sorted(sizes, reverse=True):
+        image.thumbnail((size, size), PILImage.LANCZOS)
+        out = io.BytesIO()
+        if image_format == "webp":
+            image.save(out, "WEBP", quality=80, method=4)
+        else:
+            image.save(out, "JPEG", quality=82, optimize=True, progressive=True)
+        variants.append(
+            RenderedVariant(
+                name=str(size),
+                extension=extension,
+                content_type=content_type,
+                width=image.width,
+                height=image.height,
+                data=out.getvalue(),
+            )
+        )
+
+    return ProcessedImage(
+        header=header,
+        blurhash=compute_blurhash(image),
+        variants=variants,
+    )
@@ -0,0 +1,147 @@
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+SOI = b"\xff\xd8"
+SOS = 0xDA
+APP1 = 0xE1  # EXIF and XMP
+APP13 = 0xED  # Photoshop / IPTC
+# SOF0-SOF15, except DHT (C4), JPG (C8) and DAC (CC) which share the range
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+STANDALONE_MARKERS = {0x01, *range(0xD0, 0xD8)}
+ORIENTATION_TAG = 0x0112
+
+
+@dataclass
+class JpegHeader:
+    width: int
+    height: int
+    orientation: int = 1
+
+
+def read_exif_orientation(tiff: bytes) -> int:
+    try:
+        byteorder = {b"II": "little", b"MM": "big"}[tiff[:2]]
+        offset = int.from_bytes(tiff[4:8], byteorder)
+        count = int.from_bytes(tiff[offset : offset + 2], byteorder)
+        for entry in range(offset + 2, offset + 2 + count * 12, 12):
+            if int.from_bytes(tiff[entry : entry + 2], byteorder) == ORIENTATION_TAG:
+                orientation = int.from_bytes(tiff[entry + 8 : entry + 10], byteorder)
+                return orientation if 1 <= orientation <= 8 else 1
+    except (KeyError, IndexError):
+        pass
+    return 1
+
+
+def orientation_segment(orientation: int) -> bytes:
+    # A minimal APP1 with an IFD0 holding only the Orientation tag
+    tiff = (
+        b"MM\x00\x2a\x00\x00\x00\x08"
+        + (1).to_bytes(2, "big")
+        + ORIENTATION_TAG.to_bytes(2, "big")
+        + (3).to_bytes(2, "big")  # SHORT
+        + (1).to_bytes(4, "big")
+        + orientation.to_bytes(2, "big")
+        + b"\x00\x00"
+        + b"\x00\x00\x00\x00"
+    )
+    payload = b"Exif\x00\x00" + tiff
+    return b"\xff\xe1" + (len(payload) + 2).to_bytes(2, "big") + payload
+
+
+class JpegMetadataFilter:
+    """Rewrites a JPEG stream chunk by chunk as it is stored.
+
+    Segments before the scan data are parsed as they arrive to record the
+    dimensions and EXIF orientation without decoding anything. EXIF, XMP and
+    IPTC segments are dropped, with the orientation kept in a minimal EXIF
+    segment so the image still displays upright. Everything from the start of
+    scan onwards is passed through untouched. Input that is not a well-formed
+    JPEG is passed through as-is.
+    """
+
+    def __init__(self, max_header_bytes: int = 1024 * 1024):
+        self.header: Optional[JpegHeader] = None
+        self._max_header_bytes = max_header_bytes
+        self._buffer = bytearray()
+        self._started = False
+        self._passthrough = False
+        self._size: Optional[Tuple[int, int]] = None
+        self._orientation = 1
+
+    def feed(self, data: bytes | memoryview) -> bytes | memoryview:
+        if self._passthrough:
+            return data
+
+        self._buffer += data
+        out = bytearray()
+        if not self._started:
+            if len(self._buffer) < 2:
+                return b""
+            if self._buffer[:2] != SOI:
+                return self._pass_rest(out)
+            out += SOI
+            del self._buffer[:2]
+            self._started = True
+
+        while len(self._buffer) >= 2:
+            if self._buffer[0] != 0xFF:
+                return self._pass_rest(out)
+
+            marker = self._buffer[1]
+            if marker == 0xFF:
+                # Fill byte before a marker
+                del self._buffer[:1]
+                continue
+            if marker in STANDALONE_MARKERS:
+                out += self._buffer[:2]
+                del self._buffer[:2]
+                continue
+            if marker == SOS:
+                if self._size is not None:
+                    self.header = JpegHeader(*self._size, self._orientation)
+                return self._pass_rest(out)
+
+            if len(self._buffer) < 4:
+                break
+            length = int.from_bytes(self._buffer[2:4], "big")
+            if len(self._buffer) < length + 2:
+                if len(self._buffer) > self._max_header_bytes:
+                    return self._pass_rest(out)
+                break
+
+            segment = bytes(self._buffer[: length + 2])
+            del self._buffer[: length + 2]
+            payload = segment[4:]
+
+            if marker == APP1:
+                if payload.startswith(b"Exif\x00\x00"):
+                    self._orientation = read_exif_orientation(payload[6:])
+                    if self._orientation != 1:
+                        out += orientation_segment(self._orientation)
+                continue
+            if marker == APP13:
+                continue
+            if marker in SOF_MARKERS and len(payload) >= 5:
+                height = int.from_bytes(payload[1:3], "big")
+                width = int.from_bytes(payload[3:5], "big")
+                self._size = (width, height)
+            out += segment
+
+        return bytes(out)
+
+    def finish(self) -> bytes:
+        if self._passthrough:
+            return b""
+        return self._pass_rest(bytearray())
+
+    def _pass_rest(self, out: bytearray) -> bytes:
+        out += self._buffer
+        self._buffer.clear()
+        self._passthrough = True
+        return bytes(out)
+
+
+def strip_jpeg_metadata(data: bytes) -> Tuple[bytes, Optional[JpegHeader]]:
+    jpeg_filter = JpegMetadataFilter(max_header_bytes=len(data))
+    stripped = bytes(jpeg_filter.feed(data)) + jpeg_filter.finish()
+    return stripped, jpeg_filter.header
@@ -0,0 +1,74 @@
+from dataclasses import dataclass
+import hashlib
+import os
+from typing import BinaryIO, Optional, Protocol
+import uuid
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class StreamFilter(Protocol):
+    def feed(self, data: bytes | memoryview) -> bytes | memoryview: ...
+
+    def finish(self) -> bytes: ...
+
+
+@dataclass
+class StoredUpload:
+    size: int
+    sha256: str
+
+
+def stream_to_file(
+    source: BinaryIO,
+    path: str,
+    max_bytes: int,
+    buffer_size: int,
+    head: bytes = b"",
+    stream_filter: Optional[StreamFilter] = None,
+) -> StoredUpload:
+    # Runs as one threadpool job per upload, reusing a single large buffer.
+    # Bytes go to a temporary file that is only renamed into place once
+    # complete, so readers never see a partial image. `head` holds anything
+    # already read off `source` for content sniffing. `stream_filter` may
+    # rewrite the bytes on their way to disk; the limit applies to the input.
+    directory, name = os.path.split(path)
+    temp_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex}.tmp")
+    digest = hashlib.sha256()
+    received = len(head)
+    written = 0
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+
+    try:
+        with open(temp_path, "wb") as out:
+
+            def write(chunk: bytes | memoryview) -> None:
+                nonlocal written
+                if chunk:
+                    digest.update(chunk)
+                    out.write(chunk)
+                    written += len(chunk)
+
+            if received > max_bytes:
+                raise UploadTooLarge()
+            write(stream_filter.feed(head) if stream_filter else head)
+            while read := source.readinto(view):
+                received += read
+                if received > max_bytes:
+                    raise UploadTooLarge()
+                chunk = view[:read]
+                write(stream_filter.feed(chunk) if stream_filter else chunk)
+            if stream_filter:
+                write(stream_filter.finish())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    return StoredUpload(size=written, sha256=digest.hexdigest())
@@ -1,28 +1,141 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+import hashlib
 import logging
+import sys
+import threading
 from time import time
-from typing import Dict, Any, Sequence
-from urllib.parse import urlparse
+from typing import Dict, Any, Iterable, List, Optional, Sequence, Set, Tuple
+from urllib.parse import quote, urlparse
 
 from boto3.session import Session as AWSSession
+from botocore.auth import SIGV4_TIMESTAMP, S3SigV4QueryAuth
+from botocore.awsrequest import AWSRequest
 from botocore.config import Config
-from botocore.exceptions import ClientError
-from freezegun import freeze_time
+from botocore.credentials import ReadOnlyCredentials
+from botocore.exceptions import ClientError, NoCredentialsError
 from mypy_boto3_s3.client import S3Client
 
+from app.core.cache import LRUCache
 from app.core.config import settings
 
+PresignedURLKey = Tuple[str, str, bool, datetime]
+
+
+class S3ClientPool:
+    """Long-lived S3 clients shared by every request in the process.
+
+    botocore clients are thread-safe once built, but building one reloads the
+    endpoint and service model JSON, so each (region, addressing style,
+    endpoint) combination is only ever constructed once.
+    """
+
+    def __init__(self, session: Optional[AWSSession] = None):
+        self.session = session or AWSSession()
+        self._clients: Dict[Tuple[str, str, Optional[str]], S3Client] = {}
+        self._lock = threading.Lock()
+
+    def client(
+        self,
+        region_name: Optional[str] = None,
+        addressing_style: str = "auto",
+        endpoint_url: Optional[str] = None,
+    ) -> S3Client:
+        key = (
+            region_name or settings.AWS_DEFAULT_REGION,
+            addressing_style,
+            endpoint_url,
+        )
+        s3_client = self._clients.get(key)
+        if s3_client is None:
+            with self._lock:
+                s3_client = self._clients.get(key)
+                if s3_client is None:
+                    s3_client = self.session.client(
+                        "s3",
+                        endpoint_url=endpoint_url,
+                        config=Config(
+                            region_name=key[0],
+                            signature_version="s3v4",
+                            s3={"addressing_style": addressing_style},
+                        ),
+                    )
+                    self._clients[key] = s3_client
+        return s3_client
+
+    def credentials(self) -> ReadOnlyCredentials:
+        # The botocore session caches the resolved provider chain and refreshes
+        # temporary credentials in place, so this is cheap to call per signature
+        return self.session.get_credentials().get_frozen_credentials()
+
+
+_client_pool: Optional[S3ClientPool] = None
+_client_pool_lock = threading.Lock()
+
+
+def get_s3_client_pool() -> S3ClientPool:
+    global _client_pool
+    if _client_pool is None:
+        with _client_pool_lock:
+            if _client_pool is None:
+                _client_pool = S3ClientPool()
+    return _client_pool
+
+
+def _presigned_url_sizeof(key: PresignedURLKey, url: str) -> int:
+    # The window start datetime and the bool are shared between entries
+    return sum(sys.getsizeof(part) for part in (key, key[0], key[1], url))
+
+
+class PresignedURLCache:
+    """Memoizes presigned URLs for the current signing window.
+
+    Signatures are deterministic for a given object within a window, so they
+    only need computing once; everything is dropped when the window rolls over
+    because none of it would be reused.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self._urls: LRUCache[PresignedURLKey, str] = LRUCache(
+            max_entries, max_bytes, sizeof=_presigned_url_sizeof
+        )
+        self._window_start: Optional[datetime] = None
+        self._lock = threading.Lock()
+
+    def _roll_window(self, window_start: datetime) -> None:
+        if self._window_start is not None and window_start <= self._window_start:
+            return
+        with self._lock:
+            if self._window_start is None or window_start > self._window_start:
+                self._urls.clear()
+                self._window_start = window_start
+
+    def get(self, key: PresignedURLKey) -> Optional[str]:
+        self._roll_window(key[3])
+        return self._urls.get(key)
+
+    def set(self, key: PresignedURLKey, url: str) -> None:
+        if key[3] == self._window_start:
+            self._urls.set(key, url)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._urls.stats() | {
+            "window_start": self._window_start.isoformat()
+            if self._window_start
+            else None
+        }
+
+
+presigned_url_cache = PresignedURLCache(
+    settings.PRESIGNED_URL_CACHE_ENTRIES, settings.PRESIGNED_URL_CACHE_BYTES
+)
+
 
 def get_bucket_conditions(
-    public: bool,
+    bucket_name: str,
 ) -> Sequence[Sequence[str | int] | Dict[str, Any]]:
     return [
-        ["content-length-range", 1, 10 * 1000 * 1000],
-        {
-            "bucket": settings.PUBLIC_IMAGES_BUCKET
-            if public
-            else settings.PRIVATE_IMAGES_BUCKET
-        },
+        ["content-length-range", 1, settings.MAX_IMAGE_BYTES],
+        {"bucket": bucket_name},
     ]
 
 
@@ -31,28 +144,125 @@ def get_resource_prefix() -> str:
     return f"{now.year}/{now.month}/{now.day}"
 
 
+def get_bucket_names(public: bool) -> List[str]:
+    if public:
+        return [settings.PUBLIC_IMAGES_BUCKET, *settings.PUBLIC_IMAGES_EXTRA_BUCKETS]
+    return [settings.PRIVATE_IMAGES_BUCKET, *settings.PRIVATE_IMAGES_EXTRA_BUCKETS]
+
+
+def get_object_location(object_name: str, public: bool) -> Tuple[str, str]:
+    # S3 scales request rates per key prefix, so a hash prefix spreads one day's
+    # uploads over many partitions instead of all landing on "YYYY/M/D/"
+    buckets = get_bucket_names(public)
+    key = f"{get_resource_prefix()}/{object_name}"
+    if len(buckets) == 1 and settings.S3_KEY_SHARD_CHARS <= 0:
+        return buckets[0], key
+
+    digest = hashlib.sha256(object_name.encode()).hexdigest()
+    if settings.S3_KEY_SHARD_CHARS > 0:
+        key = f"{digest[: settings.S3_KEY_SHARD_CHARS]}/{key}"
+    return buckets[int(digest[-8:], 16) % len(buckets)], key
+
+
+def get_blob_location(sha256: str, public: bool) -> Tuple[str, str]:
+    # Content hashes are already uniformly distributed, so they pick the bucket
+    # and spread keys across partitions without any extra shard prefix
+    buckets = get_bucket_names(public)
+    return buckets[int(sha256[-8:], 16) % len(buckets)], f"blobs/{sha256}"
+
+
+def get_cloudfront_distribution(bucket_name: str, public: bool) -> str:
+    # Objects keep the bucket they were written to, so look the distribution
+    # up from the stored location rather than from the current bucket list
+    if public:
+        return settings.PUBLIC_IMAGES_EXTRA_BUCKETS.get(
+            bucket_name, settings.PUBLIC_IMAGES_CLOUDFRONT_DISTRIBUTION
+        )
+    return settings.PRIVATE_IMAGES_EXTRA_BUCKETS.get(
+        bucket_name, settings.PRIVATE_IMAGES_CLOUDFRONT_DISTRIBUTION
+    )
+
+
 def parse_s3_uri(uri: str) -> Dict[str, str]:
     o = urlparse(uri)
     return {"Bucket": o.netloc, "Key": o.path.lstrip("/")}
 
 
+class FixedTimeS3SigV4QueryAuth(S3SigV4QueryAuth):
+    """S3 query-string signer that signs as of an explicit point in time.
+
+    botocore always stamps requests with utcnow(); this mirrors
+    SigV4Auth.add_auth with the timestamp supplied by the caller instead.
+    """
+
+    def __init__(
+        self,
+        credentials: ReadOnlyCredentials,
+        region_name: str,
+        expires: int,
+        signed_at: datetime,
+    ):
+        super().__init__(credentials, "s3", region_name, expires=expires)
+        self._timestamp = signed_at.astimezone(timezone.utc).strftime(SIGV4_TIMESTAMP)
+
+    def add_auth(self, request: AWSRequest) -> None:
+        if self.credentials is None:
+            raise NoCredentialsError()
+        request.context["timestamp"] = self._timestamp
+        self._modify_request_before_signing(request)
+        canonical_request = self.canonical_request(request)
+        string_to_sign = self.string_to_sign(request, canonical_request)
+        signature = self.signature(string_to_sign, request)
+        self._inject_signature_to_request(request, signature)
+
+
+def get_signing_window_start(timestamp: Optional[float] = None) -> datetime:
+    # Start of the epoch-aligned CLOUDFRONT_PRESIGNED_URL_EXPIRY window, so that
+    # every URL signed within the window is identical and browser-cacheable
+    if timestamp is None:
+        timestamp = time()
+    return datetime.fromtimestamp(
+        timestamp - (timestamp % settings.CLOUDFRONT_PRESIGNED_URL_EXPIRY),
+        tz=timezone.utc,
+    )
+
+
+def presign_get_object_offline(
+    clients: S3ClientPool,
+    bucket: str,
+    key: str,
+    params: Dict[str, str],
+    expires_in: int,
+    signed_at: datetime,
+) -> str:
+    # Produces the same URL as a virtual-hosted client's generate_presigned_url
+    # would at signed_at, but signs straight from the cached credentials
+    region = settings.AWS_DEFAULT_REGION
+    request = AWSRequest(
+        method="GET",
+        url=f"https://{bucket}.s3.{region}.amazonaws.com/{quote(key, safe='/~')}",
+        params=params,
+    )
+    FixedTimeS3SigV4QueryAuth(
+        clients.credentials(), region, expires_in, signed_at
+    ).add_auth(request)
+    return request.url
+
+
 def create_presigned_post(
-    session: AWSSession,
+    clients: S3ClientPool,
     object_name: str,
     public: bool = False,
 ) -> Dict[str, Any]:
-    s3_client: S3Client = session.client(
-        "s3", endpoint_url=f"https://s3.{settings.AWS_DEFAULT_REGION}.amazonaws.com"
+    s3_client = clients.client(
+        endpoint_url=f"https://s3.{settings.AWS_DEFAULT_REGION}.amazonaws.com"
     )
-    bucket_name = (
-        settings.PUBLIC_IMAGES_BUCKET if public else settings.PRIVATE_IMAGES_BUCKET
-    )
-    bucket_key = f"{get_resource_prefix()}/{object_name}"
+    bucket_name, bucket_key = get_object_location(object_name, public)
     try:
         response = s3_client.generate_presigned_post(
             bucket_name,
             bucket_key,
-            Conditions=get_bucket_conditions(public),
+            Conditions=get_bucket_conditions(bucket_name),
             ExpiresIn=int(timedelta(hours=1).total_seconds()),
         )
     except ClientError as e:
@@ -64,59 +274,109 @@ def create_presigned_post(
 
 
 def create_presigned_url(
-    session: AWSSession, s3_uri: str, content_type: str, public: bool
+    clients: S3ClientPool,
+    s3_uri: str,
+    content_type: str,
+    public: bool,
+    signed_at: Optional[datetime] = None,
 ) -> str:
-    s3_client: S3Client = session.client(
-        "s3",
-        config=Config(
-            region_name=settings.AWS_DEFAULT_REGION, s3={"addressing_style": "virtual"}
-        ),
-    )
     try:
-        current_timestamp = time()
         cache_age = settings.CLOUDFRONT_PRESIGNED_URL_EXPIRY - int(
             timedelta(hours=1).total_seconds()
         )
 
-        # Freeze the time at the beginning of the epoch week to allow browser to
-        # cache the presigned URL for a week
-        with freeze_time(
-            datetime.fromtimestamp(
-                current_timestamp
-                - (current_timestamp % settings.CLOUDFRONT_PRESIGNED_URL_EXPIRY)
-            )
-        ):
-            presigned_url = s3_client.generate_presigned_url(
-                "get_object",
-                Params=parse_s3_uri(s3_uri)
-                | {
-                    "ResponseContentType": content_type,
-                    "ResponseCacheControl": f"private, max-age={cache_age}, immutable",
-                },
-                ExpiresIn=settings.CLOUDFRONT_PRESIGNED_URL_EXPIRY,
-            )
-
-            # Replace the S3 hostname with the Cloudfront distribution
-            return (
-                urlparse(presigned_url)
-                ._replace(
-                    netloc=(
-                        settings.PUBLIC_IMAGES_CLOUDFRONT_DISTRIBUTION
-                        if public
-                        else settings.PRIVATE_IMAGES_CLOUDFRONT_DISTRIBUTION
-                    )
-                )
-                .geturl()
-            )
+        # Sign as of the beginning of the epoch week to allow browser to cache
+        # the presigned URL for a week
+        if signed_at is None:
+            signed_at = get_signing_window_start()
+
+        cache_key = (s3_uri, content_type, public, signed_at)
+        cached_url = presigned_url_cache.get(cache_key)
+        if cached_url is not None:
+            return cached_url
+
+        location = parse_s3_uri(s3_uri)
+        presigned_url = presign_get_object_offline(
+            clients,
+            location["Bucket"],
+            location["Key"],
+            {
+                "response-content-type": content_type,
+                "response-cache-control": f"private, max-age={cache_age}, immutable",
+            },
+            settings.CLOUDFRONT_PRESIGNED_URL_EXPIRY,
+            signed_at,
+        )
+
+        # Replace the S3 hostname with the Cloudfront distribution
+        distribution_url = (
+            urlparse(presigned_url)
+            ._replace(netloc=get_cloudfront_distribution(location["Bucket"], public))
+            .geturl()
+        )
+        presigned_url_cache.set(cache_key, distribution_url)
+        return distribution_url
     except ClientError as e:
         logging.error(e)
         return None
 
 
-def verify_exists(session: AWSSession, s3_uri: str) -> bool:
-    s3_client: S3Client = session.client("s3")
+def verify_exists(clients: S3ClientPool, s3_uri: str) -> bool:
+    s3_client = clients.client()
     try:
         s3_client.head_object(**parse_s3_uri(s3_uri))
         return True
-    except s3_client.exceptions.NoSuchKey:
-        return False
+    except ClientError as e:
+        # HEAD responses carry no body, so a missing key surfaces as a bare 404
+        # rather than as the modeled NoSuchKey exception
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+
+
+def get_object_bytes(clients: S3ClientPool, s3_uri: str) -> bytes:
+    response = clients.client().get_object(**parse_s3_uri(s3_uri))
+    return response["Body"].read()
+
+
+def put_object_bytes(
+    clients: S3ClientPool, s3_uri: str, data: bytes, content_type: str
+) -> None:
+    clients.client().put_object(
+        **parse_s3_uri(s3_uri), Body=data, ContentType=content_type
+    )
+
+
+def copy_object(clients: S3ClientPool, source_uri: str, destination_uri: str) -> None:
+    clients.client().copy_object(
+        CopySource=parse_s3_uri(source_uri), **parse_s3_uri(destination_uri)
+    )
+
+
+def delete_object(clients: S3ClientPool, s3_uri: str) -> None:
+    clients.client().delete_object(**parse_s3_uri(s3_uri))
+
+
+def list_existing_keys(
+    clients: S3ClientPool, bucket: str, keys: Iterable[str]
+) -> Set[str]:
+    # All keys must share one prefix directory (e.g. one get_resource_prefix()
+    # day, optionally under one hash shard). A single ListObjectsV2 walk over
+    # just the span between the smallest and largest key replaces one HEAD
+    # request per key.
+    wanted = sorted(set(keys))
+    if not wanted:
+        return set()
+
+    prefix = wanted[0].rsplit("/", 1)[0] + "/"
+    paginator = clients.client().get_paginator("list_objects_v2")
+    found = set()
+    for page in paginator.paginate(
+        Bucket=bucket, Prefix=prefix, StartAfter=wanted[0][:-1]
+    ):
+        for obj in page.get("Contents", []):
+            if obj["Key"] > wanted[-1]:
+                return found.intersection(wanted)
+            found.add(obj["Key"])
+
+    return found.intersection(wanted)
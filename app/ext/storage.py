@@ -0,0 +1,246 @@
+from abc import ABC, abstractmethod
+from collections import defaultdict
+import hashlib
+import io
+import os
+import threading
+from typing import Any, BinaryIO, Dict, Iterable, Optional, Set, Tuple
+from urllib.parse import urlencode
+import uuid
+
+from app.core.config import settings
+from app.core.security import sign_media_url
+from app.ext.jpeg import JpegHeader, JpegMetadataFilter
+from app.ext.local import StoredUpload, stream_to_file
+from app.ext.s3 import (
+    S3ClientPool,
+    create_presigned_post,
+    create_presigned_url,
+    copy_object,
+    delete_object,
+    get_blob_location,
+    get_object_bytes,
+    get_s3_client_pool,
+    get_signing_window_start,
+    list_existing_keys,
+    parse_s3_uri,
+    put_object_bytes,
+    verify_exists,
+)
+
+
+class StorageBackend(ABC):
+    """Where image bytes live. `path` is the value stored in Image.path."""
+
+    def warm(self) -> None:
+        pass
+
+    @abstractmethod
+    def create_upload(self, image_id: str, public: bool) -> Tuple[str, Dict[str, Any]]:
+        # Returns the new object's path and what the client needs to upload it
+        ...
+
+    @abstractmethod
+    def exists(self, path: str) -> bool: ...
+
+    def existing(self, paths: Iterable[str]) -> Set[str]:
+        return {path for path in paths if self.exists(path)}
+
+    @abstractmethod
+    def download_url(
+        self, image_id: str, path: str, content_type: str, public: bool
+    ) -> str: ...
+
+    @abstractmethod
+    def read(self, path: str) -> bytes: ...
+
+    @abstractmethod
+    def write(self, path: str, data: bytes, content_type: str) -> None: ...
+
+    @abstractmethod
+    def copy(self, source: str, destination: str) -> None: ...
+
+    @abstractmethod
+    def delete(self, path: str) -> None: ...
+
+    @abstractmethod
+    def blob_path(self, sha256: str, public: bool) -> str:
+        # Unique per call, so a blob recreated after its last reference was
+        # deleted never shares a path with the old, still-being-removed copy
+        ...
+
+    def variant_path(self, path: str, name: str, extension: str) -> str:
+        # Derivatives sit next to the original: <id>.jpg -> <id>.640.jpg
+        return f"{os.path.splitext(path)[0]}.{name}.{extension}"
+
+
+class FilesystemStorage(StorageBackend):
+    """Images on a local or mounted filesystem, fanned out as ab/cd/<id>.jpg.
+
+    The two directory levels come from a hash of the id rather than the id
+    itself, so the fan-out stays even whatever id scheme is used.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def object_path(self, image_id: str) -> str:
+        digest = hashlib.sha256(str(image_id).encode()).hexdigest()
+        return os.path.join(self.root, digest[:2], digest[2:4], f"{image_id}.jpg")
+
+    def create_upload(self, image_id: str, public: bool) -> Tuple[str, Dict[str, Any]]:
+        return self.object_path(image_id), {
+            "url": f"{settings.API_V1_STR}/images/upload/dev/{image_id}",
+            "id": image_id,
+        }
+
+    def blob_path(self, sha256: str, public: bool) -> str:
+        return os.path.join(
+            self.root,
+            "blobs",
+            sha256[:2],
+            sha256[2:4],
+            f"{sha256}-{uuid.uuid4().hex[:8]}.jpg",
+        )
+
+    def resolve(self, file: str) -> Optional[str]:
+        # Maps the `file` of a signed URL back to a path under the root
+        root = os.path.normpath(self.root)
+        path = os.path.normpath(os.path.join(root, file))
+        return path if os.path.commonpath([path, root]) == root else None
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(path)
+
+    def download_url(
+        self, image_id: str, path: str, content_type: str, public: bool
+    ) -> str:
+        # Like the CloudFront URLs, signatures are fixed per signing window so
+        # browsers can cache them, but stay valid for a whole window after it
+        window_start = int(get_signing_window_start().timestamp())
+        expires = window_start + 2 * settings.CLOUDFRONT_PRESIGNED_URL_EXPIRY
+        # The signed URL names the file itself, so serving it needs no lookup
+        file = os.path.relpath(path, self.root)
+        query = urlencode(
+            {
+                "expires": expires,
+                "public": int(public),
+                "file": file,
+                "signature": sign_media_url(image_id, expires, public, file),
+            }
+        )
+        return f"{settings.API_V1_STR}/images/media/dev/{image_id}?{query}"
+
+    def read(self, path: str) -> bytes:
+        with open(path, "rb") as source:
+            return source.read()
+
+    def write(self, path: str, data: bytes, content_type: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        stream_to_file(io.BytesIO(data), path, len(data), settings.UPLOAD_BUFFER_SIZE)
+
+    def copy(self, source: str, destination: str) -> None:
+        # A hard link: no bytes are copied, and deleting the source later
+        # leaves the destination intact
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.link(source, destination)
+
+    def delete(self, path: str) -> None:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def save(
+        self, source: BinaryIO, path: str, head: bytes = b""
+    ) -> Tuple[StoredUpload, Optional[JpegHeader]]:
+        # EXIF is stripped and the header parsed while the upload streams in
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        jpeg_filter = JpegMetadataFilter()
+        stored = stream_to_file(
+            source,
+            path,
+            settings.MAX_IMAGE_BYTES,
+            settings.UPLOAD_BUFFER_SIZE,
+            head,
+            jpeg_filter,
+        )
+        return stored, jpeg_filter.header
+
+
+class S3Storage(StorageBackend):
+    """Images in the public and private S3 buckets, served through CloudFront."""
+
+    def __init__(self, clients: S3ClientPool):
+        self.clients = clients
+
+    def warm(self) -> None:
+        # Build the clients used on the request path before serving traffic
+        self.clients.client(
+            endpoint_url=f"https://s3.{settings.AWS_DEFAULT_REGION}.amazonaws.com"
+        )
+        self.clients.client(addressing_style="virtual")
+        self.clients.client()
+
+    def create_upload(self, image_id: str, public: bool) -> Tuple[str, Dict[str, Any]]:
+        presigned_post = create_presigned_post(self.clients, image_id, public)
+        return presigned_post["s3_uri"], presigned_post["create_response"] | {
+            "id": image_id
+        }
+
+    def exists(self, path: str) -> bool:
+        return verify_exists(self.clients, path)
+
+    def existing(self, paths: Iterable[str]) -> Set[str]:
+        # Group by bucket and day prefix so each group costs one bounded listing
+        groups: Dict[Tuple[str, str], Dict[str, str]] = defaultdict(dict)
+        for path in paths:
+            location = parse_s3_uri(path)
+            prefix = location["Key"].rsplit("/", 1)[0]
+            groups[(location["Bucket"], prefix)][location["Key"]] = path
+
+        found = set()
+        for (bucket, _), keys in groups.items():
+            for key in list_existing_keys(self.clients, bucket, keys):
+                found.add(keys[key])
+        return found
+
+    def download_url(
+        self, image_id: str, path: str, content_type: str, public: bool
+    ) -> str:
+        return create_presigned_url(self.clients, path, content_type, public)
+
+    def read(self, path: str) -> bytes:
+        return get_object_bytes(self.clients, path)
+
+    def copy(self, source: str, destination: str) -> None:
+        copy_object(self.clients, source, destination)
+
+    def delete(self, path: str) -> None:
+        delete_object(self.clients, path)
+
+    def blob_path(self, sha256: str, public: bool) -> str:
+        bucket, key = get_blob_location(sha256, public)
+        return f"s3://{bucket}/{key}-{uuid.uuid4().hex[:8]}"
+
+    def write(self, path: str, data: bytes, content_type: str) -> None:
+        put_object_bytes(self.clients, path, data, content_type)
+
+
+_storage: Optional[StorageBackend] = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> StorageBackend:
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                backend = settings.STORAGE_BACKEND or (
+                    "s3" if settings.PRODUCTION else "filesystem"
+                )
+                if backend == "s3":
+                    _storage = S3Storage(get_s3_client_pool())
+                else:
+                    _storage = FilesystemStorage(settings.LOCAL_UPLOAD_DIR)
+    return _storage
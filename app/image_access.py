@@ -0,0 +1,107 @@
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional
+import uuid
+
+from sqlalchemy import any_, bindparam, select
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.models.image import Image
+
+
+@dataclass(slots=True, frozen=True)
+class ImageAccess:
+    """The fields media lookups need to authorize and locate an image."""
+
+    public: bool
+    owner_id: uuid.UUID
+    uploaded: bool
+    path: str
+    content_type: str
+
+
+# Remembers ids with no Image row, so lookups of deleted or made-up ids
+# don't reach the database either
+NOT_FOUND = object()
+
+# Image id -> ImageAccess or NOT_FOUND. Writers invalidate entries as they
+# commit, in every worker through app.invalidation; the TTL bounds staleness
+# when a broadcast is lost.
+image_access_cache: LRUCache[str, object] = LRUCache(
+    settings.IMAGE_ACCESS_CACHE_ENTRIES, ttl=settings.IMAGE_ACCESS_CACHE_TTL_SECONDS
+)
+
+ACCESS_COLUMNS = (
+    Image.public,
+    Image.owner_id,
+    Image.uploaded,
+    Image.path,
+    Image.content_type,
+)
+
+
+def invalidate_image_access(image_id: uuid.UUID | str) -> None:
+    # Call after committing a change to an image's row: confirmation, a new
+    # path, or deletion
+    image_access_cache.pop(str(image_id))
+
+
+def cache_image_access(
+    image_id: uuid.UUID | str, row: Optional[tuple]
+) -> Optional[ImageAccess]:
+    if row is None:
+        image_access_cache.set(
+            str(image_id),
+            NOT_FOUND,
+            ttl=settings.IMAGE_ACCESS_NEGATIVE_CACHE_TTL_SECONDS,
+        )
+        return None
+
+    access = ImageAccess(*row)
+    image_access_cache.set(str(image_id), access)
+    return access
+
+
+async def load_image_access(
+    db: AsyncSession, image_id: uuid.UUID | str
+) -> Optional[ImageAccess]:
+    access = image_access_cache.get(str(image_id))
+    if access is not None:
+        return None if access is NOT_FOUND else access
+
+    row = (
+        await db.execute(select(*ACCESS_COLUMNS).where(Image.id == image_id))
+    ).first()
+    return cache_image_access(image_id, row)
+
+
+async def load_image_accesses(
+    db: AsyncSession, image_ids: Iterable[uuid.UUID]
+) -> Dict[uuid.UUID, Optional[ImageAccess]]:
+    # Like load_image_access, with every cache miss read in a single query
+    accesses = {}
+    missing = []
+    for image_id in image_ids:
+        access = image_access_cache.get(str(image_id))
+        if access is None:
+            missing.append(image_id)
+        else:
+            accesses[image_id] = None if access is NOT_FOUND else access
+
+    if missing:
+        # One array parameter, so every batch size shares a prepared statement
+        ids = bindparam("ids", missing, type_=ARRAY(UUID(as_uuid=True)))
+        rows = {
+            row.id: row
+            for row in await db.execute(
+                select(Image.id, *ACCESS_COLUMNS).where(Image.id == any_(ids))
+            )
+        }
+        for image_id in missing:
+            row = rows.get(image_id)
+            accesses[image_id] = cache_image_access(
+                image_id, row[1:] if row is not None else None
+            )
+    return accesses
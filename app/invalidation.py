@@ -0,0 +1,89 @@
+from datetime import datetime
+import logging
+import os
+from typing import Any, Iterable, List, Set
+import uuid
+
+import orjson
+from sqlalchemy import func, select
+
+from app.db.session import AsyncSessionLocal
+from app.ext.feed_cache import MemoryFeedCache, get_feed_cache, invalidate_feed_image
+from app.ext.feed_events import FEED_INVALIDATION_CHANNEL
+from app.image_access import invalidate_image_access
+
+logger = logging.getLogger(__name__)
+
+# Lets a process skip the notifications it sent itself
+ORIGIN = f"{os.getpid()}-{uuid.uuid4().hex}"
+
+# Stays well under the 8000 byte NOTIFY payload limit
+IMAGES_PER_NOTIFICATION = 50
+
+
+async def drop_cached_image(
+    image_id: uuid.UUID | str,
+    owner_id: uuid.UUID | str,
+    created_at: datetime,
+    public: bool,
+    shared: bool = True,
+) -> List[str]:
+    invalidate_image_access(image_id)
+    # A shared feed cache was already invalidated by whoever sent the change
+    if not shared and not isinstance(get_feed_cache(), MemoryFeedCache):
+        return []
+    return await invalidate_feed_image(owner_id, created_at, image_id, public)
+
+
+async def invalidate_images(images: Iterable[Any]) -> Set[str]:
+    """Drops cached lookups and feed pages of images whose rows changed.
+
+    Call after committing any change to an image, with anything carrying its
+    id, owner_id, created_at and public, such as an Image or a selected Row.
+    Caches local to other workers, and to the API when called from a CLI, are
+    invalidated through FEED_INVALIDATION_CHANNEL. Returns the surrogate keys
+    to hand to purge_feed_keys.
+    """
+    keys: Set[str] = set()
+    changes = []
+    for image in images:
+        keys.update(
+            await drop_cached_image(
+                image.id, image.owner_id, image.created_at, image.public
+            )
+        )
+        changes.append(
+            [str(image.id), str(image.owner_id), image.created_at, image.public]
+        )
+
+    try:
+        async with AsyncSessionLocal() as db:
+            for start in range(0, len(changes), IMAGES_PER_NOTIFICATION):
+                payload = orjson.dumps(
+                    {
+                        "origin": ORIGIN,
+                        "images": changes[start : start + IMAGES_PER_NOTIFICATION],
+                    }
+                ).decode()
+                await db.execute(
+                    select(func.pg_notify(FEED_INVALIDATION_CHANNEL, payload))
+                )
+            await db.commit()
+    except Exception:
+        logger.exception("Could not broadcast invalidations of %d images", len(changes))
+    return keys
+
+
+async def apply_invalidation(payload: str) -> None:
+    # Handles what invalidate_images sent from another process
+    event = orjson.loads(payload)
+    if event["origin"] == ORIGIN:
+        return
+    for image_id, owner_id, created_at, public in event["images"]:
+        await drop_cached_image(
+            image_id,
+            owner_id,
+            datetime.fromisoformat(created_at),
+            public,
+            shared=False,
+        )
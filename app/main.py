@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import os
 
@@ -7,12 +8,22 @@ if os.getenv("PRODUCTION") == "true":
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
 from app.api.v1.api import api_router
 from app.core.config import settings
+from app.db.session import async_engine
+from app.api.v1.endpoints.feed import publish_confirmed_image
+from app.ext.feed_events import listen_for_feed_events
+from app.ext.storage import get_storage
+from app.invalidation import apply_invalidation
+from app.reconcile import run_forever as run_upload_reconciler
+from app.variants import shutdown_variant_pool
 
 app = FastAPI(
-    title=settings.PROJECT_NAME, openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    title=settings.PROJECT_NAME,
+    openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    default_response_class=ORJSONResponse,
 )
 
 if settings.PRODUCTION:
@@ -30,3 +41,51 @@ app.add_middleware(
 )
 
 app.include_router(api_router, prefix=settings.API_V1_STR)
+
+
+@app.on_event("startup")
+def init_storage() -> None:
+    get_storage().warm()
+
+
+@app.on_event("startup")
+async def start_upload_reconciler() -> None:
+    if settings.UPLOAD_RECONCILER_ENABLED:
+        app.state.upload_reconciler = asyncio.create_task(
+            run_upload_reconciler(get_storage())
+        )
+
+
+@app.on_event("shutdown")
+async def stop_upload_reconciler() -> None:
+    task = getattr(app.state, "upload_reconciler", None)
+    if task is not None:
+        task.cancel()
+
+
+@app.on_event("startup")
+async def start_feed_listener() -> None:
+    # Always runs: other workers' cache invalidations arrive through it too
+    app.state.feed_listener = asyncio.create_task(
+        listen_for_feed_events(
+            publish_confirmed_image if settings.FEED_STREAM_ENABLED else None,
+            apply_invalidation,
+        )
+    )
+
+
+@app.on_event("shutdown")
+async def stop_feed_listener() -> None:
+    task = getattr(app.state, "feed_listener", None)
+    if task is not None:
+        task.cancel()
+
+
+@app.on_event("shutdown")
+async def close_db_pool() -> None:
+    await async_engine.dispose()
+
+
+@app.on_event("shutdown")
+def close_variant_pool() -> None:
+    shutdown_variant_pool()
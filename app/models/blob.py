@@ -0,0 +1,30 @@
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from sqlalchemy import BigInteger, SmallInteger, String
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.db.base_class import Base
+
+
+class Blob(Base):
+    """Stored image bytes, shared by every Image with the same content.
+
+    Public and private uploads never share a blob, since they live in
+    different buckets behind different CloudFront distributions.
+    """
+
+    __tablename__ = "blob"
+    sha256: Mapped[str] = mapped_column(String(64), primary_key=True)
+    public: Mapped[bool] = mapped_column(primary_key=True)
+    path: Mapped[str] = mapped_column()
+    size: Mapped[int] = mapped_column(BigInteger)
+    refcount: Mapped[int] = mapped_column(default=1)
+    created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow)
+    # Rendered once per blob and copied onto every Image that references it
+    variants: Mapped[Optional[Dict[str, Any]]] = mapped_column(JSONB)
+    width: Mapped[Optional[int]] = mapped_column()
+    height: Mapped[Optional[int]] = mapped_column()
+    orientation: Mapped[Optional[int]] = mapped_column(SmallInteger)
+    blurhash: Mapped[Optional[str]] = mapped_column()
@@ -1,7 +1,16 @@
 from datetime import datetime
+from typing import Any, Dict, Optional
 import uuid
 
-from sqlalchemy import ForeignKey
+from sqlalchemy import (
+    ForeignKey,
+    ForeignKeyConstraint,
+    Index,
+    SmallInteger,
+    String,
+    text,
+)
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.db.base_class import Base
@@ -9,6 +18,29 @@ from app.db.base_class import Base
 
 class Image(Base):
     __tablename__ = "image"
+    __table_args__ = (
+        # Keyset pagination for /feed/latest only ever reads confirmed public images
+        Index(
+            "ix_image_public_feed",
+            "created_at",
+            "id",
+            postgresql_where=text("public AND uploaded"),
+        ),
+        Index("ix_image_owner_id_created_at", "owner_id", "created_at", "id"),
+        # Lets the upload reconciler find abandoned slots without a table scan
+        Index(
+            "ix_image_pending_upload",
+            "created_at",
+            "id",
+            postgresql_where=text("NOT uploaded"),
+        ),
+        ForeignKeyConstraint(
+            ["blob_sha256", "public"],
+            ["blob.sha256", "blob.public"],
+            name="image_blob_sha256_public_fkey",
+        ),
+        Index("ix_image_blob", "blob_sha256", "public"),
+    )
     id: Mapped[uuid.UUID] = mapped_column(primary_key=True, default=uuid.uuid4)
     path: Mapped[str] = mapped_column()
     content_type: Mapped[str] = mapped_column()
@@ -17,3 +49,12 @@ class Image(Base):
     owner_id: Mapped[uuid.UUID] = mapped_column(ForeignKey("user.id"))
     owner: Mapped["User"] = relationship(back_populates="images")
     uploaded: Mapped[bool] = mapped_column(default=False)
+    # Variant name -> {path, content_type, width, height}, set once rendered
+    variants: Mapped[Optional[Dict[str, Any]]] = mapped_column(JSONB)
+    # As stored in the file; orientation is the EXIF value, 5-8 swap the axes
+    width: Mapped[Optional[int]] = mapped_column()
+    height: Mapped[Optional[int]] = mapped_column()
+    orientation: Mapped[Optional[int]] = mapped_column(SmallInteger)
+    blurhash: Mapped[Optional[str]] = mapped_column()
+    # Set once the upload has been hashed; path then points at the blob
+    blob_sha256: Mapped[Optional[str]] = mapped_column(String(64))
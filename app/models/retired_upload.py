@@ -0,0 +1,20 @@
+from datetime import datetime
+import uuid
+
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.db.base_class import Base
+
+
+class RetiredUpload(Base):
+    """An upload object superseded by its blob.
+
+    URLs signed for the upload before it was claimed stay in feeds, caches
+    and clients, so the object is only deleted by the upload reconciler once
+    `delete_after` has passed, or along with its image.
+    """
+
+    __tablename__ = "retired_upload"
+    path: Mapped[str] = mapped_column(primary_key=True)
+    image_id: Mapped[uuid.UUID] = mapped_column(index=True)
+    delete_after: Mapped[datetime] = mapped_column(index=True)
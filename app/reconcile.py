@@ -0,0 +1,153 @@
+import asyncio
+from datetime import datetime, timedelta
+import logging
+import sys
+from typing import Optional, Tuple
+import uuid
+
+from sqlalchemy import delete, select, tuple_, update
+
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.ext.feed_cache import purge_feed_keys
+from app.ext.storage import StorageBackend, get_storage
+from app.invalidation import invalidate_images
+from app.models.image import Image
+from app.models.retired_upload import RetiredUpload
+from app.models.user import User as _
+from app.variants import process_upload
+
+logger = logging.getLogger(__name__)
+
+Keyset = Tuple[datetime, uuid.UUID]
+
+
+async def reconcile_batch(
+    storage: StorageBackend, after: Optional[Keyset]
+) -> Tuple[Optional[Keyset], int, int]:
+    stale_before = datetime.utcnow() - timedelta(
+        seconds=settings.UPLOAD_RECONCILER_STALE_AFTER_SECONDS
+    )
+
+    async with AsyncSessionLocal() as db:
+        query = select(
+            Image.id, Image.path, Image.created_at, Image.owner_id, Image.public
+        ).where(Image.uploaded.is_(False), Image.created_at < stale_before)
+        if after is not None:
+            query = query.where(tuple_(Image.created_at, Image.id) > after)
+        rows = (
+            await db.execute(
+                query.order_by(Image.created_at, Image.id).limit(
+                    settings.UPLOAD_RECONCILER_BATCH_SIZE
+                )
+            )
+        ).all()
+        if not rows:
+            return None, 0, 0
+
+        existing = await asyncio.to_thread(storage.existing, [row.path for row in rows])
+        confirmed = [row.id for row in rows if row.path in existing]
+        abandoned = [row.id for row in rows if row.path not in existing]
+
+        # Re-check uploaded so a confirmation racing with the sweep wins; the
+        # rows it already confirmed are left to its own processing
+        newly_confirmed = set()
+        if confirmed:
+            newly_confirmed = set(
+                await db.scalars(
+                    update(Image)
+                    .where(Image.id.in_(confirmed), Image.uploaded.is_(False))
+                    .values(uploaded=True)
+                    .returning(Image.id)
+                )
+            )
+        if abandoned:
+            await db.execute(
+                delete(Image).where(Image.id.in_(abandoned), Image.uploaded.is_(False))
+            )
+        await db.commit()
+
+    # Rows confirmed by someone else in the meantime are theirs to invalidate
+    keys = await invalidate_images(
+        row for row in rows if row.id in newly_confirmed or row.id in abandoned
+    )
+    await purge_feed_keys(keys)
+
+    # Hashed into blobs and rendered like uploads confirmed by their owner
+    for row in rows:
+        if row.id in newly_confirmed:
+            await process_upload(storage, row.id, row.path, notify=True)
+
+    return (rows[-1].created_at, rows[-1].id), len(newly_confirmed), len(abandoned)
+
+
+async def delete_retired_uploads(storage: StorageBackend) -> int:
+    deleted = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            # Skips rows locked by a deletion of their image, which removes
+            # the object itself
+            paths = list(
+                await db.scalars(
+                    select(RetiredUpload.path)
+                    .where(RetiredUpload.delete_after < datetime.utcnow())
+                    .order_by(RetiredUpload.delete_after)
+                    .limit(settings.UPLOAD_RECONCILER_BATCH_SIZE)
+                    .with_for_update(skip_locked=True)
+                )
+            )
+            if not paths:
+                return deleted
+            await asyncio.gather(
+                *(asyncio.to_thread(storage.delete, path) for path in paths)
+            )
+            await db.execute(delete(RetiredUpload).where(RetiredUpload.path.in_(paths)))
+            await db.commit()
+        deleted += len(paths)
+        await asyncio.sleep(settings.UPLOAD_RECONCILER_BATCH_INTERVAL_SECONDS)
+
+
+async def reconcile(storage: StorageBackend) -> None:
+    after, total_confirmed, total_deleted = None, 0, 0
+    while True:
+        after, confirmed, deleted = await reconcile_batch(storage, after)
+        if after is None:
+            break
+        total_confirmed += confirmed
+        total_deleted += deleted
+        # Pace the sweep so it never competes with foreground traffic
+        await asyncio.sleep(settings.UPLOAD_RECONCILER_BATCH_INTERVAL_SECONDS)
+    retired = await delete_retired_uploads(storage)
+
+    logger.info(
+        "Reconciled upload slots: %d confirmed, %d abandoned and deleted, "
+        "%d retired uploads deleted",
+        total_confirmed,
+        total_deleted,
+        retired,
+    )
+
+
+async def run_forever(storage: StorageBackend) -> None:
+    while True:
+        try:
+            await reconcile(storage)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(e)
+        await asyncio.sleep(settings.UPLOAD_RECONCILER_SWEEP_INTERVAL_SECONDS)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    logger.info("Reconciling abandoned upload slots")
+    storage = get_storage()
+    if "--forever" in sys.argv[1:]:
+        asyncio.run(run_forever(storage))
+    else:
+        asyncio.run(reconcile(storage))
+
+
+if __name__ == "__main__":
+    main()
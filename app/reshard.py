@@ -0,0 +1,138 @@
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import sys
+from typing import Any, Dict, Optional, Tuple
+import uuid
+
+from sqlalchemy import select, update
+
+from app.db.session import AsyncSessionLocal
+from app.ext.feed_cache import purge_feed_keys
+from app.ext.storage import FilesystemStorage, get_storage
+from app.invalidation import invalidate_images
+from app.models.image import Image
+from app.models.user import User as _
+
+logger = logging.getLogger(__name__)
+
+
+def move_into_shard(
+    storage: FilesystemStorage,
+    image_id: uuid.UUID,
+    path: str,
+    variants: Optional[Dict[str, Any]],
+) -> Tuple[str, Optional[Dict[str, Any]]]:
+    target = storage.object_path(str(image_id))
+    if not os.path.exists(target):
+        # Also look in the flat directory, so rerunning after an interrupted
+        # move or an upload that raced with the previous run picks it up
+        flat = os.path.join(storage.root, f"{image_id}.jpg")
+        for source in dict.fromkeys((path, flat)):
+            if source != target and os.path.exists(source):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(source, target)
+                break
+
+    # Variants sit next to their original, so they follow it into the shard
+    if variants:
+        variants = dict(variants)
+        for name, variant in variants.items():
+            variant_target = os.path.join(
+                os.path.dirname(target), os.path.basename(variant["path"])
+            )
+            if variant["path"] != variant_target and not os.path.exists(variant_target):
+                os.replace(variant["path"], variant_target)
+            variants[name] = variant | {"path": variant_target}
+
+    # Slots that were never uploaded move too, so their upload lands in a shard
+    return target, variants
+
+
+async def reshard(
+    storage: FilesystemStorage, executor: ThreadPoolExecutor, batch_size: int
+) -> None:
+    loop = asyncio.get_running_loop()
+    after: Optional[uuid.UUID] = None
+    moved = failed = 0
+
+    while True:
+        async with AsyncSessionLocal() as db:
+            query = (
+                select(
+                    Image.id,
+                    Image.path,
+                    Image.variants,
+                    Image.owner_id,
+                    Image.created_at,
+                    Image.public,
+                )
+                # Blobs are laid out by content hash from the start
+                .where(Image.blob_sha256.is_(None))
+                .order_by(Image.id)
+                .limit(batch_size)
+            )
+            if after is not None:
+                query = query.where(Image.id > after)
+            rows = (await db.execute(query)).all()
+            if not rows:
+                break
+            after = rows[-1].id
+
+            targets = await asyncio.gather(
+                *(
+                    loop.run_in_executor(
+                        executor,
+                        move_into_shard,
+                        storage,
+                        row.id,
+                        row.path,
+                        row.variants,
+                    )
+                    for row in rows
+                ),
+                return_exceptions=True,
+            )
+
+            changes, moved_rows = [], []
+            for row, moved_to in zip(rows, targets):
+                if isinstance(moved_to, Exception):
+                    logger.error("Could not move %s: %s", row.path, moved_to)
+                    failed += 1
+                elif moved_to != (row.path, row.variants):
+                    target, variants = moved_to
+                    changes.append({"id": row.id, "path": target, "variants": variants})
+                    moved_rows.append(row)
+
+            if changes:
+                await db.execute(update(Image), changes)
+                await db.commit()
+                await purge_feed_keys(await invalidate_images(moved_rows))
+            moved += len(changes)
+
+    logger.info("Resharded %d images, %d failed", moved, failed)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Move images from the flat LOCAL_UPLOAD_DIR into hashed shards"
+    )
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    storage = get_storage()
+    if not isinstance(storage, FilesystemStorage):
+        logger.error("Resharding only applies to the filesystem storage backend")
+        sys.exit(1)
+
+    logger.info("Resharding %s", storage.root)
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        asyncio.run(reshard(storage, executor, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+from typing import List
+
+from pydantic import BaseModel, UUID4
+
+
+class ImageIds(BaseModel):
+    ids: List[UUID4]
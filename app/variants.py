@@ -0,0 +1,198 @@
+import asyncio
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import multiprocessing
+import threading
+from typing import Optional
+import uuid
+
+from sqlalchemy import or_, select
+
+from app.blobs import (
+    abandon_blob_claim,
+    claim_blob,
+    finish_blob_claim,
+    update_blob_metadata,
+)
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.ext.feed_cache import purge_feed_keys
+from app.ext.feed_events import notify_image_confirmed
+from app.ext.imaging import process_original
+from app.ext.jpeg import strip_jpeg_metadata
+from app.ext.storage import StorageBackend, get_storage
+from app.invalidation import invalidate_images
+from app.models.image import Image
+from app.models.user import User as _
+
+logger = logging.getLogger(__name__)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_variant_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # Spawned rather than forked: forking a process that is running
+                # an event loop and thread pools can deadlock the child
+                _pool = ProcessPoolExecutor(
+                    max_workers=settings.IMAGE_VARIANT_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _pool
+
+
+def shutdown_variant_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+async def process_upload(
+    storage: StorageBackend, image_id: uuid.UUID, path: str, notify: bool = False
+) -> None:
+    # Runs after the response has been sent; failures only cost the variants
+    # and placeholder, since the feed falls back to the original. `notify`
+    # announces a newly confirmed upload to feed streams once it has moved to
+    # its blob, so streamed URLs stay valid.
+    # Edge-cached feeds showing the image, purged once when the job ends
+    keys = set()
+    try:
+        async with AsyncSessionLocal() as db:
+            db_image = await db.get(Image, image_id)
+            if db_image is None:
+                return
+            path = db_image.path
+            original = await asyncio.to_thread(storage.read, path)
+
+            if db_image.blob_sha256 is None:
+                # Direct-to-S3 uploads never pass through the server, so their
+                # metadata can only be stripped, and their content hashed, now
+                original, header = await asyncio.to_thread(
+                    strip_jpeg_metadata, original
+                )
+                sha256 = await asyncio.to_thread(
+                    lambda: hashlib.sha256(original).hexdigest()
+                )
+                # The stripped bytes go straight to the blob, never back over
+                # the upload
+                claim = await claim_blob(
+                    db, storage, db_image, sha256, len(original), original
+                )
+                if claim is None:
+                    return
+                blob, created = claim.blob, claim.created
+                try:
+                    if created and header is not None:
+                        db_image.width = blob.width = header.width
+                        db_image.height = blob.height = header.height
+                        db_image.orientation = blob.orientation = header.orientation
+                    # Only the job that actually claimed the upload announces it
+                    if notify and claim.upload_path is not None:
+                        await notify_image_confirmed(
+                            db, db_image.id, db_image.owner_id, db_image.public
+                        )
+                    await db.commit()
+                except BaseException:
+                    await abandon_blob_claim(storage, claim)
+                    raise
+                await finish_blob_claim(storage, claim)
+                # Lookups and the feed may already have it at its upload path
+                keys.update(await invalidate_images([db_image]))
+                if not created:
+                    return
+                path = blob.path
+            sha256, public = db_image.blob_sha256, db_image.public
+
+        processed = await asyncio.get_running_loop().run_in_executor(
+            get_variant_pool(),
+            process_original,
+            original,
+            settings.IMAGE_VARIANT_SIZES,
+            settings.IMAGE_VARIANT_FORMAT,
+        )
+
+        writes = []
+        variants = {}
+        for variant in processed.variants:
+            variant_path = storage.variant_path(path, variant.name, variant.extension)
+            writes.append(
+                asyncio.to_thread(
+                    storage.write, variant_path, variant.data, variant.content_type
+                )
+            )
+            variants[variant.name] = {
+                "path": variant_path,
+                "content_type": variant.content_type,
+                "width": variant.width,
+                "height": variant.height,
+            }
+        await asyncio.gather(*writes)
+
+        values = {"variants": variants, "blurhash": processed.blurhash}
+        if processed.header is not None:
+            values |= {
+                "width": processed.header.width,
+                "height": processed.header.height,
+                "orientation": processed.header.orientation,
+            }
+        async with AsyncSessionLocal() as db:
+            updated = await update_blob_metadata(db, sha256, public, **values)
+            await db.commit()
+        keys.update(await invalidate_images(updated))
+    except Exception:
+        logger.exception("Could not process image %s", image_id)
+    finally:
+        await purge_feed_keys(keys)
+
+
+async def backfill(storage: StorageBackend, batch_size: int) -> None:
+    after: Optional[uuid.UUID] = None
+    total = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            query = (
+                select(Image.id, Image.path, Image.blob_sha256, Image.public)
+                .where(
+                    Image.uploaded,
+                    or_(Image.variants.is_(None), Image.blurhash.is_(None)),
+                )
+                .order_by(Image.id)
+                .limit(batch_size)
+            )
+            if after is not None:
+                query = query.where(Image.id > after)
+            rows = (await db.execute(query)).all()
+        if not rows:
+            break
+
+        after = rows[-1].id
+        # Images sharing a blob are all updated by rendering it once
+        pending = {
+            (row.blob_sha256, row.public) if row.blob_sha256 else row.id: row
+            for row in rows
+        }
+        await asyncio.gather(
+            *(process_upload(storage, row.id, row.path) for row in pending.values())
+        )
+        total += len(rows)
+        logger.info("Processed %d images", total)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    logger.info("Processing images without variants or placeholders")
+    try:
+        asyncio.run(backfill(get_storage(), settings.IMAGE_VARIANT_WORKERS * 8))
+    finally:
+        shutdown_variant_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+import os
+
+# The benchmarks import app modules, whose settings refuse to load without a
+# database and AWS configuration. None of the benchmarks talk to either.
+for name, value in {
+    "PRODUCTION": "false",
+    "FORWARD_FACING_NAME": "localhost",
+    "POSTGRES_HOST": "localhost",
+    "POSTGRES_PORT": "5432",
+    "POSTGRES_USER": "benchmark",
+    "POSTGRES_PASSWORD": "benchmark",
+    "POSTGRES_DB": "benchmark",
+    "AWS_ACCESS_KEY_ID": "AKIABENCHMARK",
+    "AWS_SECRET_ACCESS_KEY": "benchmark",
+}.items():
+    os.environ.setdefault(name, value)
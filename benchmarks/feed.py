@@ -0,0 +1,135 @@
+"""Feed page serialization: ORM objects + stdlib JSON vs. row DTOs + orjson.
+
+Run with `python -m benchmarks.feed [iterations]`. Reports time and bytes
+allocated per page of IMAGE_PAGINATION images, from the selected row to the
+encoded response body. No database is needed: rows are built in memory.
+"""
+
+from datetime import datetime, timedelta
+import sys
+import tempfile
+from time import perf_counter
+import tracemalloc
+import uuid
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from app.api.v1.endpoints.feed import (
+    FEED_COLUMNS,
+    FeedImage,
+    build_feed_content,
+    render_feed_images,
+)
+from app.core.config import settings
+from app.ext.storage import FilesystemStorage
+from app.models.image import Image
+from app.models.user import User as _
+
+
+def make_rows(storage: FilesystemStorage) -> list:
+    owner_id = uuid.uuid4()
+    created_at = datetime(2024, 1, 1)
+    rows = []
+    for i in range(settings.IMAGE_PAGINATION):
+        image_id = uuid.uuid4()
+        path = storage.object_path(str(image_id))
+        variants = {
+            str(size): {
+                "path": storage.variant_path(path, str(size), "jpg"),
+                "content_type": "image/jpeg",
+                "width": size,
+                "height": size * 3 // 4,
+            }
+            for size in settings.IMAGE_VARIANT_SIZES
+        }
+        rows.append(
+            (
+                image_id,
+                owner_id,
+                path,
+                "image/jpeg",
+                True,
+                variants,
+                1080,
+                810,
+                1,
+                "LEHV6nWB2yk8pyo0adR*.7kCMdnj",
+                created_at - timedelta(seconds=i),
+            )
+        )
+    return rows
+
+
+def legacy_page(storage: FilesystemStorage, rows: list) -> bytes:
+    # Full Image objects, str() on every field and the stdlib encoder
+    images = [
+        Image(**{column.key: value for column, value in zip(FEED_COLUMNS, row)})
+        for row in rows
+    ]
+    results = []
+    for image_record in images:
+        results.append(
+            {
+                "id": str(image_record.id),
+                "creator": str(image_record.owner_id),
+                "download_url": storage.download_url(
+                    str(image_record.id),
+                    image_record.path,
+                    image_record.content_type,
+                    image_record.public,
+                ),
+                "variants": {
+                    name: storage.download_url(
+                        str(image_record.id),
+                        variant["path"],
+                        variant["content_type"],
+                        image_record.public,
+                    )
+                    for name, variant in (image_record.variants or {}).items()
+                },
+                "width": image_record.width,
+                "height": image_record.height,
+                "orientation": image_record.orientation,
+                "blurhash": image_record.blurhash,
+                "created_at": str(image_record.created_at),
+            }
+        )
+    return JSONResponse({"success": True, "results": results}).body
+
+
+def current_page(storage: FilesystemStorage, rows: list) -> bytes:
+    images = [FeedImage(*row) for row in rows]
+    return ORJSONResponse(build_feed_content(render_feed_images(images, storage))).body
+
+
+def measure(label: str, fn, storage: FilesystemStorage, rows: list, iterations: int):
+    fn(storage, rows)
+    start = perf_counter()
+    for _ in range(iterations):
+        fn(storage, rows)
+    per_page = (perf_counter() - start) / iterations
+
+    tracemalloc.start()
+    body = fn(storage, rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"{label:<28} {per_page * 1000:>8.2f} ms/page "
+        f"{peak / 1024:>8.1f} KiB peak allocated {len(body):>8} bytes body"
+    )
+    return per_page
+
+
+def main() -> None:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with tempfile.TemporaryDirectory() as directory:
+        storage = FilesystemStorage(directory)
+        rows = make_rows(storage)
+        legacy = measure("ORM + stdlib json", legacy_page, storage, rows, iterations)
+        current = measure("row DTO + orjson", current_page, storage, rows, iterations)
+    print(f"speedup: {legacy / current:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
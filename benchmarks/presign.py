@@ -0,0 +1,110 @@
+"""Presigned URL signing throughput: freezegun + per-call client vs. explicit time.
+
+Run with `python -m benchmarks.presign [iterations]`. Signing and cache hits
+are timed separately, each over `iterations` distinct object keys. freezegun
+is only needed for the legacy path and lives in the dev dependency group.
+"""
+
+from datetime import datetime, timedelta
+import sys
+from time import perf_counter, time
+from typing import List
+from urllib.parse import urlparse
+
+from botocore.config import Config
+from freezegun import freeze_time
+
+from app.core.config import settings
+from app.ext.s3 import S3ClientPool, create_presigned_url, presigned_url_cache
+
+S3_URI = "s3://yoctogram-benchmark/2024/1/1/0b7c2f0e-0d7e-4a4e-9f1f-3f1f0c9c6f7e"
+
+
+def legacy_create_presigned_url(
+    clients: S3ClientPool, s3_uri: str, content_type: str, public: bool
+) -> str:
+    # The pre-pooling implementation, pinned to SigV4 so its output is comparable
+    s3_client = clients.session.client(
+        "s3",
+        config=Config(
+            region_name=settings.AWS_DEFAULT_REGION,
+            signature_version="s3v4",
+            s3={"addressing_style": "virtual"},
+        ),
+    )
+    current_timestamp = time()
+    cache_age = settings.CLOUDFRONT_PRESIGNED_URL_EXPIRY - int(
+        timedelta(hours=1).total_seconds()
+    )
+    with freeze_time(
+        datetime.utcfromtimestamp(
+            current_timestamp
+            - (current_timestamp % settings.CLOUDFRONT_PRESIGNED_URL_EXPIRY)
+        )
+    ):
+        bucket = urlparse(s3_uri).netloc
+        presigned_url = s3_client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": bucket, "Key": urlparse(s3_uri).path.lstrip("/")}
+            | {
+                "ResponseContentType": content_type,
+                "ResponseCacheControl": f"private, max-age={cache_age}, immutable",
+            },
+            ExpiresIn=settings.CLOUDFRONT_PRESIGNED_URL_EXPIRY,
+        )
+        return (
+            urlparse(presigned_url)
+            ._replace(netloc=settings.PUBLIC_IMAGES_CLOUDFRONT_DISTRIBUTION)
+            .geturl()
+        )
+
+
+def measure(label: str, fn, uris: List[str]) -> float:
+    start = perf_counter()
+    for uri in uris:
+        fn(uri)
+    elapsed = perf_counter() - start
+    print(f"{label:<32} {len(uris) / elapsed:>10.0f} URLs/s")
+    return elapsed
+
+
+def main() -> None:
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    clients = S3ClientPool()
+
+    legacy = legacy_create_presigned_url(clients, S3_URI, "image/jpeg", True)
+    current = create_presigned_url(clients, S3_URI, "image/jpeg", True)
+    assert legacy == current, "signing paths disagree"
+
+    # A distinct key per call, so the current path signs every URL rather than
+    # answering from presigned_url_cache
+    uris = [f"{S3_URI}-{i}" for i in range(iterations)]
+    before = presigned_url_cache.stats()
+
+    legacy_elapsed = measure(
+        "freezegun + client per call",
+        lambda uri: legacy_create_presigned_url(clients, uri, "image/jpeg", True),
+        uris,
+    )
+    miss_elapsed = measure(
+        "explicit signing time (miss)",
+        lambda uri: create_presigned_url(clients, uri, "image/jpeg", True),
+        uris,
+    )
+    # The same keys again, now all in the cache
+    hit_elapsed = measure(
+        "presigned_url_cache (hit)",
+        lambda uri: create_presigned_url(clients, uri, "image/jpeg", True),
+        uris,
+    )
+    after = presigned_url_cache.stats()
+    print(
+        f"cache hits: {after['hits'] - before['hits']}, "
+        f"misses: {after['misses'] - before['misses']}"
+    )
+    print(f"speedup, signing: {legacy_elapsed / miss_elapsed:.1f}x")
+    print(f"speedup, cached: {legacy_elapsed / hit_elapsed:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Local upload throughput: 2 KiB aiofiles loop vs. the single-thread streaming copy.
+
+Run with `python -m benchmarks.upload [megabytes] [iterations]`.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from time import perf_counter, process_time
+
+import aiofiles
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.ext.local import stream_to_file
+
+
+def make_upload(payload: bytes) -> UploadFile:
+    spooled = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    spooled.write(payload)
+    spooled.seek(0)
+    return UploadFile(spooled)
+
+
+async def legacy_upload(file: UploadFile, path: str) -> None:
+    first_chunk = await file.read(settings.CHUNK_SIZE)
+    async with aiofiles.open(path, "wb") as image_file:
+        await image_file.write(first_chunk)
+        while chunk := await file.read(settings.CHUNK_SIZE):
+            await image_file.write(chunk)
+
+
+async def streaming_upload(file: UploadFile, path: str) -> None:
+    first_chunk = await file.read(settings.CHUNK_SIZE)
+    await run_in_threadpool(
+        stream_to_file,
+        file.file,
+        path,
+        settings.MAX_IMAGE_BYTES,
+        settings.UPLOAD_BUFFER_SIZE,
+        first_chunk,
+    )
+
+
+async def measure(label, upload, payload: bytes, directory: str, iterations: int):
+    wall = cpu = 0.0
+    for i in range(iterations):
+        file = make_upload(payload)
+        path = os.path.join(directory, f"{label}-{i}.jpg")
+        wall_start, cpu_start = perf_counter(), process_time()
+        await upload(file, path)
+        wall += perf_counter() - wall_start
+        cpu += process_time() - cpu_start
+        await file.close()
+        os.unlink(path)
+
+    megabytes = len(payload) * iterations / 1e6
+    print(
+        f"{label:<10} {megabytes / wall:>8.1f} MB/s  "
+        f"{cpu / iterations * 1000:>8.2f} ms CPU/upload"
+    )
+
+
+async def main() -> None:
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 9.5
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    payload = os.urandom(int(megabytes * 1e6))
+
+    with tempfile.TemporaryDirectory() as directory:
+        await measure("legacy", legacy_upload, payload, directory, iterations)
+        await measure("streaming", streaming_upload, payload, directory, iterations)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())